@@ -0,0 +1,223 @@
+"""Allocation tracking to find what actually grows across requests.
+
+While tracking is on, every request is bracketed by tracemalloc snapshots
+and an RSS reading, and its retained growth is split into:
+
+    python   Python objects (tracemalloc domain 0)
+    numpy    NumPy array buffers (NumPy's own tracemalloc domain)
+    native   the rest of the RSS growth: TensorFlow, OpenCV and allocator
+             caches, which tracemalloc cannot see
+
+Growth is aggregated per route, and the allocation sites that grew most,
+since tracking started and per route, are kept for the admin endpoint.
+Snapshots are expensive, so this is a diagnostic mode: enable it with
+``ALLOC_TRACKING=1`` or at runtime, and expect slower requests while on.
+"""
+import os
+import sysconfig
+import threading
+import time
+import tracemalloc
+from collections import Counter, defaultdict, deque
+
+import numpy as np
+import psutil
+
+from request_profiler import acquire_tracemalloc, release_tracemalloc
+
+ALLOC_TRACKING = os.environ.get('ALLOC_TRACKING', '0') == '1'
+ALLOC_TRACKING_FRAMES = int(os.environ.get('ALLOC_TRACKING_FRAMES', 5))
+NUMPY_DOMAIN = np.lib.tracemalloc_domain
+TOP_SITES = 25
+RECENT_REQUESTS = 50
+
+_LIBRARY_PATHS = tuple({sysconfig.get_path(name) for name in ('stdlib', 'purelib', 'platlib')})
+
+_IGNORED = (
+    tracemalloc.Filter(False, tracemalloc.__file__),
+    tracemalloc.Filter(False, __file__),
+)
+
+
+def _domain_sizes(snapshot):
+    python = numpy = 0
+    for trace in snapshot.traces:
+        if trace.domain == NUMPY_DOMAIN:
+            numpy += trace.size
+        elif trace.domain == 0:
+            python += trace.size
+    return python, numpy
+
+
+def _site(traceback):
+    """Innermost frame in this service's code, falling back to the innermost frame"""
+    for frame in reversed(traceback):  # frames run oldest to most recent
+        if not frame.filename.startswith(_LIBRARY_PATHS):
+            return f"{frame.filename}:{frame.lineno}"
+    return _allocated_in(traceback)
+
+
+def _allocated_in(traceback):
+    frame = traceback[-1]
+    return f"{frame.filename}:{frame.lineno}"
+
+
+class RouteStats:
+    def __init__(self):
+        self.requests = 0
+        self.growth = Counter()
+        self.sites = Counter()
+        self.recent = deque(maxlen=RECENT_REQUESTS)
+
+    def to_dict(self):
+        return {
+            'requests': self.requests,
+            'totalGrowthBytes': dict(self.growth),
+            'meanGrowthBytes': {key: value / self.requests for key, value in self.growth.items()} if self.requests else {},
+            'topGrowingSites': [{'site': site, 'sizeDiffBytes': size}
+                                for site, size in self.sites.most_common(TOP_SITES)],
+            'recent': list(self.recent)
+        }
+
+
+class AllocationTracker:
+    def __init__(self, frames=ALLOC_TRACKING_FRAMES, native_probes=None):
+        self.frames = frames
+        # Optional name -> callable returning bytes (or None) for allocators outside tracemalloc
+        self.native_probes = native_probes or {}
+        self.enabled = False
+        self._lock = threading.Lock()
+        self._process = psutil.Process(os.getpid())
+        self._reset_state()
+
+    def _reset_state(self):
+        self._routes = defaultdict(RouteStats)
+        self._baseline = None
+        self._baseline_rss = None
+        self._latest = None
+        self.started_at = None
+
+    def _snapshot(self):
+        return tracemalloc.take_snapshot().filter_traces(_IGNORED)
+
+    def _try_snapshot(self):
+        """Snapshot, or None when tracemalloc has been stopped under us"""
+        try:
+            return self._snapshot()
+        except RuntimeError:
+            return None
+
+    def _probe(self):
+        readings = {}
+        for name, probe in list(self.native_probes.items()):
+            try:
+                value = probe()
+            except Exception:
+                value = None
+            if value is None:
+                self.native_probes.pop(name)  # unsupported here; stop asking
+            else:
+                readings[name] = value
+        return readings
+
+    def start(self):
+        with self._lock:
+            if self.enabled:
+                return
+            acquire_tracemalloc(self.frames)
+            self._reset_state()
+            self._baseline = self._snapshot()
+            self._baseline_rss = self._process.memory_info().rss
+            self.started_at = time.time()
+            self.enabled = True
+
+    def stop(self):
+        with self._lock:
+            if not self.enabled:
+                return
+            self.enabled = False
+            # Keep a final snapshot so the report still works once tracing is off
+            self._latest = self._try_snapshot() or self._latest
+            release_tracemalloc()
+
+    def reset(self):
+        with self._lock:
+            was_enabled = self.enabled
+        if was_enabled:
+            self.stop()
+            self.start()
+
+    def begin_request(self):
+        """Measurements taken before a request; None when tracking is off"""
+        if not self.enabled:
+            return None
+        snapshot = self._try_snapshot()
+        if snapshot is None:
+            return None
+        return snapshot, self._process.memory_info().rss, self._probe()
+
+    def end_request(self, route, before):
+        if before is None or not self.enabled:
+            return
+        snapshot_before, rss_before, probes_before = before
+        snapshot_after = self._try_snapshot()
+        if snapshot_after is None:
+            return
+        rss_after = self._process.memory_info().rss
+        probes_after = self._probe()
+
+        python_before, numpy_before = _domain_sizes(snapshot_before)
+        python_after, numpy_after = _domain_sizes(snapshot_after)
+        growth = {
+            'python': python_after - python_before,
+            'numpy': numpy_after - numpy_before,
+            'rss': rss_after - rss_before
+        }
+        growth['native'] = growth['rss'] - growth['python'] - growth['numpy']
+        for name in probes_after:
+            if name in probes_before:
+                growth[name] = probes_after[name] - probes_before[name]
+
+        sites = [(_site(stat.traceback), stat.size_diff) for stat in
+                 snapshot_after.compare_to(snapshot_before, 'traceback')[:TOP_SITES] if stat.size_diff > 0]
+
+        with self._lock:
+            stats = self._routes[route]
+            stats.requests += 1
+            stats.growth.update(growth)
+            stats.sites.update(dict(sites))
+            stats.recent.append({'timestamp': time.time(), **growth})
+            self._latest = snapshot_after
+
+    def report(self):
+        with self._lock:
+            if self._baseline is None:
+                return {'enabled': self.enabled}
+            latest = (self._try_snapshot() if self.enabled else None) or self._latest or self._baseline
+            python_base, numpy_base = _domain_sizes(self._baseline)
+            python_now, numpy_now = _domain_sizes(latest)
+            rss_now = self._process.memory_info().rss
+            top_sites = [
+                {
+                    'site': _site(stat.traceback),
+                    'allocatedIn': _allocated_in(stat.traceback),
+                    'sizeDiffBytes': stat.size_diff,
+                    'countDiff': stat.count_diff,
+                    'sizeBytes': stat.size,
+                    'traceback': stat.traceback.format()
+                }
+                for stat in latest.compare_to(self._baseline, 'traceback')[:TOP_SITES]
+            ]
+            return {
+                'enabled': self.enabled,
+                'since': self.started_at,
+                'growthSinceStartBytes': {
+                    'python': python_now - python_base,
+                    'numpy': numpy_now - numpy_base,
+                    'rss': rss_now - self._baseline_rss,
+                    'native': (rss_now - self._baseline_rss) - (python_now - python_base) - (numpy_now - numpy_base)
+                },
+                'rssBytes': rss_now,
+                'routes': {route: stats.to_dict() for route, stats in self._routes.items()},
+                'topGrowingSites': top_sites
+            }
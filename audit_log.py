@@ -0,0 +1,311 @@
+"""Durable audit log of verification decisions, written off the request path.
+
+Request handlers call ``AuditLog.record``, which only puts a tuple on a
+bounded in-memory queue. A writer thread drains whatever has queued up,
+encodes it as compact CRC-checked binary records and appends the whole
+group with a single write; the file is fsynced every
+``AUDIT_FSYNC_INTERVAL_MS`` and on rotation and shutdown. Segments rotate
+at ``AUDIT_SEGMENT_BYTES``. If the queue is full the decision is counted
+as dropped and logged rather than stalling the request. The writer starts
+with the first record, so a log created before gunicorn forks its
+workers writes from each worker.
+
+``verified`` is the outcome the client was given: a match whose image
+upload then failed is recorded as not verified, with its distance.
+
+Layout of ``AUDIT_LOG_DIR``:
+    audit-<first timestamp ms>-<pid>.log   one file per segment and worker
+
+Query the files with:
+    python audit_log.py --voter V123 --since 2024-05-01T08:00 --format csv
+    python audit_log.py --route /verify-voting --rejected --count
+"""
+import argparse
+import csv
+import glob
+import json
+import logging
+import os
+import queue
+import struct
+import sys
+import threading
+import time
+import weakref
+from datetime import datetime
+
+from crc_log import frame, fsync_dir, intact
+
+logger = logging.getLogger(__name__)
+
+AUDIT_LOG_DIR = os.environ.get('AUDIT_LOG_DIR', os.path.join(os.getcwd(), 'audit_log'))
+AUDIT_QUEUE_SIZE = int(os.environ.get('AUDIT_QUEUE_SIZE', 10000))
+AUDIT_FSYNC_INTERVAL = float(os.environ.get('AUDIT_FSYNC_INTERVAL_MS', 1000)) / 1000
+AUDIT_SEGMENT_BYTES = int(os.environ.get('AUDIT_SEGMENT_BYTES', 64 * 1024 * 1024))
+AUDIT_BATCH_SIZE = 1024
+
+# crc32 of everything after it, timestamp, distance, threshold, matchPercentage, verified;
+# then route, voterId, model, requestId and imageUrl, each as a uint16 length and utf-8 bytes
+RECORD_HEADER = struct.Struct('<IddddB')
+STRING_LENGTH = struct.Struct('<H')
+STRING_FIELDS = ('route', 'voterId', 'model', 'requestId', 'imageUrl')
+NAN = float('nan')
+
+
+def encode_record(timestamp, route, voter_id, distance, threshold, match_percentage, verified,
+                  model=None, request_id=None, image_url=None):
+    body = [RECORD_HEADER.pack(
+        0, timestamp,
+        NAN if distance is None else distance,
+        NAN if threshold is None else threshold,
+        NAN if match_percentage is None else match_percentage,
+        1 if verified else 0
+    )[4:]]
+    for value in (route, voter_id, model, request_id, image_url):
+        data = str(value or '').encode('utf-8')[:0xFFFF]
+        body.append(STRING_LENGTH.pack(len(data)))
+        body.append(data)
+    body = b''.join(body)
+    return frame(body)
+
+
+def iter_records(data):
+    """Yield (end, record dict) until the data ends or a record is torn/corrupt"""
+    view = memoryview(data)
+    offset = 0
+    while offset + RECORD_HEADER.size <= len(data):
+        _, timestamp, distance, threshold, match_percentage, verified = RECORD_HEADER.unpack_from(data, offset)
+        end = offset + RECORD_HEADER.size
+        strings = []
+        for _ in STRING_FIELDS:
+            if end + STRING_LENGTH.size > len(data):
+                return
+            (length,) = STRING_LENGTH.unpack_from(data, end)
+            end += STRING_LENGTH.size
+            strings.append((end, end + length))
+            end += length
+        if not intact(view, offset, end):
+            return
+        record = {
+            'timestamp': timestamp,
+            'distance': distance,
+            'threshold': threshold,
+            'matchPercentage': match_percentage,
+            'verified': bool(verified)
+        }
+        for name, (start, stop) in zip(STRING_FIELDS, strings):
+            record[name] = bytes(view[start:stop]).decode('utf-8')
+        yield end, record
+        offset = end
+
+
+class AuditLog:
+    def __init__(self, directory=AUDIT_LOG_DIR, queue_size=AUDIT_QUEUE_SIZE,
+                 fsync_interval=AUDIT_FSYNC_INTERVAL, segment_bytes=AUDIT_SEGMENT_BYTES):
+        self.directory = directory
+        self.fsync_interval = fsync_interval
+        self.segment_bytes = segment_bytes
+        os.makedirs(directory, exist_ok=True)
+
+        self._queue_size = queue_size
+        self._init_writer()
+
+        # The writer thread does not survive a fork; each child starts its own, on its own segment
+        log = weakref.ref(self)
+        os.register_at_fork(after_in_child=lambda: log() is not None and log()._init_writer())
+
+    def _init_writer(self):
+        self._queue = queue.Queue(maxsize=self._queue_size)
+        self._start_lock = threading.Lock()
+        self._writer = None  # started with the first record
+        self._file = None
+        self._segment_size = 0
+        self._last_fsync = time.monotonic()
+        self._unsynced = False
+        self._closed = False
+        self.written = 0
+        self.dropped = 0
+
+    def record(self, route, voter_id, distance, threshold, match_percentage, verified,
+               model=None, request_id=None, image_url=None):
+        """Queue a decision for the writer; never blocks the caller"""
+        if self._closed:
+            return False
+        if self._writer is None:
+            with self._start_lock:
+                if self._writer is None:
+                    self._writer = threading.Thread(target=self._write_loop, name='audit-log-writer', daemon=True)
+                    self._writer.start()
+        try:
+            self._queue.put_nowait((time.time(), route, voter_id, distance, threshold, match_percentage,
+                                    verified, model, request_id, image_url))
+            return True
+        except queue.Full:
+            self.dropped += 1
+            logger.error(f"Audit queue full; dropped decision for voter {voter_id} on {route}")
+            return False
+
+    # Writing
+
+    def _open_segment(self, timestamp):
+        if self._file is not None:
+            self._sync()
+            self._file.close()
+        path = os.path.join(self.directory, f'audit-{int(timestamp * 1000):013d}-{os.getpid()}.log')
+        self._file = open(path, 'ab')
+        self._segment_size = self._file.tell()
+        fsync_dir(self.directory)
+
+    def _sync(self):
+        if self._unsynced:
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self._unsynced = False
+        self._last_fsync = time.monotonic()
+
+    def _write_batch(self, batch):
+        if self._file is None or self._segment_size >= self.segment_bytes:
+            self._open_segment(batch[0][0])
+        data = b''.join(encode_record(*entry) for entry in batch)
+        self._file.write(data)
+        self._file.flush()
+        self._segment_size += len(data)
+        self._unsynced = True
+        self.written += len(batch)
+
+    def _drain(self, first):
+        """The first entry plus whatever else is queued, up to a batch; the bool is True at the close marker"""
+        batch = [] if first is None else [first]
+        closing = first is None
+        while len(batch) < AUDIT_BATCH_SIZE:
+            try:
+                entry = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if entry is None:
+                closing = True
+            else:
+                batch.append(entry)
+        return batch, closing
+
+    def _write_loop(self):
+        closing = False
+        while True:
+            entry = None
+            if not closing:
+                timeout = max(0.0, self.fsync_interval - (time.monotonic() - self._last_fsync))
+                try:
+                    entry = self._queue.get(timeout=timeout if self._unsynced else None)
+                except queue.Empty:  # fsync interval elapsed
+                    self._try_sync()
+                    continue
+
+            batch, closed = self._drain(entry)
+            closing = closing or closed
+            if batch:
+                try:
+                    self._write_batch(batch)
+                except OSError as e:
+                    self.dropped += len(batch)
+                    logger.error(f"Audit log write failed, {len(batch)} decisions lost: {str(e)}")
+            if time.monotonic() - self._last_fsync >= self.fsync_interval:
+                self._try_sync()
+            if closing and self._queue.empty():
+                self._try_sync()
+                return
+
+    def _try_sync(self):
+        if self._file is None:
+            return
+        try:
+            self._sync()
+        except OSError as e:
+            logger.error(f"Audit log fsync failed: {str(e)}")
+
+    def close(self):
+        """Write and fsync everything queued so far"""
+        if self._closed:
+            return
+        self._closed = True
+        with self._start_lock:
+            if self._writer is None:
+                return
+        self._queue.put(None)
+        self._writer.join()
+        if self._file is not None:
+            self._file.close()
+
+    def stats(self):
+        return {
+            'written': self.written,
+            'dropped': self.dropped,
+            'queued': self._queue.qsize()
+        }
+
+
+# Querying
+
+def segment_paths(directory=AUDIT_LOG_DIR):
+    return sorted(glob.glob(os.path.join(directory, 'audit-*.log')))
+
+
+def scan(directory=AUDIT_LOG_DIR, since=None, until=None, voter_id=None, route=None, verified=None):
+    """Yield matching records from every segment, oldest segment first"""
+    for path in segment_paths(directory):
+        started = int(os.path.basename(path).split('-')[1]) / 1000
+        if until is not None and started > until:
+            continue
+        with open(path, 'rb') as f:
+            data = f.read()
+        for _, record in iter_records(data):
+            if since is not None and record['timestamp'] < since:
+                continue
+            if until is not None and record['timestamp'] > until:
+                continue
+            if voter_id is not None and record['voterId'] != voter_id:
+                continue
+            if route is not None and record['route'] != route:
+                continue
+            if verified is not None and record['verified'] != verified:
+                continue
+            yield record
+
+
+def _parse_time(value):
+    return datetime.fromisoformat(value).timestamp()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Query the verification audit log')
+    parser.add_argument('--dir', default=AUDIT_LOG_DIR, help='Audit log directory')
+    parser.add_argument('--voter', help='Only decisions for this voter ID')
+    parser.add_argument('--route', help='Only decisions from this route, e.g. /verify-voting')
+    parser.add_argument('--since', type=_parse_time, help='ISO timestamp (local time unless an offset is given)')
+    parser.add_argument('--until', type=_parse_time, help='ISO timestamp (local time unless an offset is given)')
+    outcome = parser.add_mutually_exclusive_group()
+    outcome.add_argument('--verified', dest='verified', action='store_const', const=True)
+    outcome.add_argument('--rejected', dest='verified', action='store_const', const=False)
+    parser.add_argument('--format', choices=('jsonl', 'csv'), default='jsonl')
+    parser.add_argument('--count', action='store_true', help='Only print the number of matching decisions')
+    args = parser.parse_args(argv)
+
+    records = scan(args.dir, args.since, args.until, args.voter, args.route, args.verified)
+    if args.count:
+        print(sum(1 for _ in records))
+        return
+
+    if args.format == 'csv':
+        writer = csv.DictWriter(sys.stdout, fieldnames=['time', 'timestamp', 'distance', 'threshold',
+                                                       'matchPercentage', 'verified', *STRING_FIELDS])
+        writer.writeheader()
+    for record in records:
+        record['time'] = datetime.fromtimestamp(record['timestamp']).isoformat()
+        if args.format == 'csv':
+            writer.writerow(record)
+        else:
+            # NaN marks a field the decision did not have
+            print(json.dumps({key: None if value != value else value for key, value in record.items()}))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,101 @@
+"""Benchmark the embedding store: bulk load, group-committed single writes and restart time.
+
+Usage:
+    python benchmark_embedding_store.py                  # 1M voters
+    python benchmark_embedding_store.py --voters 100000 --tail 10000
+"""
+import argparse
+import json
+import shutil
+import tempfile
+import threading
+import time
+
+import numpy as np
+
+from embedding_store import EMBEDDING_DIM, EmbeddingStore
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the embedding store')
+    parser.add_argument('--voters', type=int, default=1000000)
+    parser.add_argument('--tail', type=int, default=20000, help='Re-registrations and deletions after the snapshot')
+    parser.add_argument('--writers', type=int, default=16, help='Concurrent single-record writers')
+    parser.add_argument('--writes', type=int, default=200, help='Single-record writes per writer')
+    parser.add_argument('--dir', default=None, help='Store directory (default: a temporary directory)')
+    args = parser.parse_args(argv)
+
+    directory = args.dir or tempfile.mkdtemp(prefix='embedding-store-bench-')
+    rng = np.random.default_rng(0)
+    report = {'voters': args.voters, 'tail': args.tail, 'directory': directory}
+
+    try:
+        store = EmbeddingStore(directory, snapshot_every=0)
+
+        started = time.perf_counter()
+        for start in range(0, args.voters, 10000):
+            count = min(10000, args.voters - start)
+            embeddings = rng.standard_normal((count, EMBEDDING_DIM), dtype=np.float32)
+            store.put_many((f'voter-{start + i}', embeddings[i]) for i in range(count))
+        report['bulkLoadSeconds'] = time.perf_counter() - started
+        report['bulkRecordsPerSecond'] = args.voters / report['bulkLoadSeconds']
+
+        started = time.perf_counter()
+        store.snapshot()
+        report['snapshotSeconds'] = time.perf_counter() - started
+
+        # Concurrent single writes, each acknowledged only after its group is fsynced
+        latencies = []
+        latency_lock = threading.Lock()
+
+        def writer(worker):
+            embedding = np.zeros(EMBEDDING_DIM, dtype=np.float32)
+            local = []
+            for i in range(args.writes):
+                t0 = time.perf_counter()
+                store.put(f'voter-{(worker * args.writes + i) % args.voters}', embedding)
+                local.append(time.perf_counter() - t0)
+            with latency_lock:
+                latencies.extend(local)
+
+        started = time.perf_counter()
+        threads = [threading.Thread(target=writer, args=(worker,)) for worker in range(args.writers)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - started
+        latencies = np.array(latencies) * 1000
+        report['singleWrites'] = {
+            'writers': args.writers,
+            'writesPerSecond': len(latencies) / elapsed,
+            'p50Ms': float(np.percentile(latencies, 50)),
+            'p99Ms': float(np.percentile(latencies, 99))
+        }
+
+        # Tail after the snapshot: re-registrations and deletions
+        tail_ids = rng.choice(args.voters, size=args.tail, replace=False)
+        for i, voter in enumerate(tail_ids):
+            if i % 2:
+                store.delete(f'voter-{voter}')
+            else:
+                store.put(f'voter-{voter}', rng.standard_normal(EMBEDDING_DIM, dtype=np.float32))
+        live = len(store)
+        store.close()
+
+        reopened = EmbeddingStore(directory, snapshot_every=0)
+        report['restart'] = {
+            'loadSeconds': reopened.load_seconds,
+            'embeddings': len(reopened),
+            'consistent': len(reopened) == live
+        }
+        reopened.close()
+    finally:
+        if args.dir is None:
+            shutil.rmtree(directory, ignore_errors=True)
+
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
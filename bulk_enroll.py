@@ -0,0 +1,229 @@
+"""Bulk enrolment of existing voter photos into the embedding store.
+
+Reads either an NDJSON export (one ``{"userId": ..., "faceImage": <base64>}``
+object per line; a MongoDB export with ``_id`` and ``faceEmbedding`` works
+as-is) or a directory of images named ``<userId>.<ext>``. Decoding and
+preprocessing run in a process pool, embeddings are computed in batches,
+and each batch is written to the store as a single shard. Progress is
+checkpointed after every batch so an interrupted run resumes where it
+stopped.
+
+Usage:
+    python bulk_enroll.py voters.ndjson
+    python bulk_enroll.py photos/ --batch-size 512 --workers 4
+"""
+import argparse
+import base64
+import itertools
+import json
+import logging
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import cv2
+import numpy as np
+
+from embedding_store import EMBEDDING_STORE_DIR, EmbeddingStore
+from preprocessing import resize_and_pad
+
+logger = logging.getLogger(__name__)
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp', '.webp')
+
+
+def _record_id(obj):
+    user_id = obj.get('userId') or obj.get('_id')
+    if isinstance(user_id, dict):  # MongoDB extended JSON {"$oid": ...}
+        user_id = user_id.get('$oid')
+    return str(user_id) if user_id else None
+
+
+def iter_records(source):
+    """Yield (user_id, kind, payload) for every record in an NDJSON file or image directory"""
+    if os.path.isdir(source):
+        for name in sorted(os.listdir(source)):
+            stem, ext = os.path.splitext(name)
+            if ext.lower() in IMAGE_EXTENSIONS:
+                yield stem, 'path', os.path.join(source, name)
+        return
+
+    with open(source) as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                obj = json.loads(line)
+            except ValueError:
+                yield None, 'invalid', 'Malformed JSON line'
+                continue
+            image = obj.get('faceImage') or obj.get('faceEmbedding') or obj.get('image')
+            yield _record_id(obj), 'base64', image
+
+
+def preprocess_record(record):
+    """Decode one record into a uint8 RGB face tensor; runs in a pool worker"""
+    user_id, kind, payload = record
+    try:
+        if kind == 'invalid':
+            return user_id, None, payload
+        if not user_id or not payload:
+            return user_id, None, 'Missing userId or image'
+        if kind == 'path':
+            with open(payload, 'rb') as f:
+                raw = f.read()
+        else:
+            raw = base64.b64decode(payload.split(',')[1] if ',' in payload else payload)
+        img = cv2.imdecode(np.frombuffer(raw, np.uint8), cv2.IMREAD_COLOR)
+        if img is None:
+            return user_id, None, 'Failed to decode image'
+        return user_id, resize_and_pad(cv2.cvtColor(img, cv2.COLOR_BGR2RGB)), None
+    except Exception as e:
+        return user_id, None, str(e)
+
+
+def load_facenet():
+    """Return a function mapping a float32 (N, 160, 160, 3) batch to (N, 128) embeddings"""
+    from deepface import DeepFace
+    model = DeepFace.build_model('Facenet')
+    return lambda batch: model.predict(batch, verbose=0)
+
+
+class Checkpoint:
+    """Number of source records already committed to the store, saved atomically after each batch"""
+
+    def __init__(self, path, source):
+        self.path = path
+        self.source = os.path.abspath(source)
+        self.processed = self.enrolled = self.failed = 0
+        if os.path.exists(path):
+            with open(path) as f:
+                state = json.load(f)
+            if state.get('source') == self.source:
+                self.processed = state['processed']
+                self.enrolled = state['enrolled']
+                self.failed = state['failed']
+
+    def save(self):
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump({
+                'source': self.source,
+                'processed': self.processed,
+                'enrolled': self.enrolled,
+                'failed': self.failed
+            }, f)
+        os.replace(tmp_path, self.path)
+
+
+def _batched(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        batch = list(itertools.islice(iterator, size))
+        if not batch:
+            return
+        yield batch
+
+
+def run(source, store, embed=None, batch_size=256, workers=None, checkpoint_path=None):
+    """Enrol every record in source into store and return a throughput report"""
+    embed = embed or load_facenet()
+    if checkpoint_path is None:
+        checkpoint_path = os.path.join(store.directory, f'bulk-{os.path.basename(os.path.normpath(source))}.checkpoint.json')
+    checkpoint = Checkpoint(checkpoint_path, source)
+    resumed_from = checkpoint.processed
+    stem = checkpoint_path[:-len('.checkpoint.json')] if checkpoint_path.endswith('.checkpoint.json') \
+        else os.path.splitext(checkpoint_path)[0]
+    failures_path = stem + '.failures.ndjson'
+
+    records = itertools.islice(iter_records(source), resumed_from, None)
+    timings = {'decode_wait': 0.0, 'embed': 0.0, 'write': 0.0}
+    started = time.perf_counter()
+
+    def commit(batch, results):
+        t0 = time.perf_counter()
+        results = list(results)
+        timings['decode_wait'] += time.perf_counter() - t0
+
+        ok = [(user_id, tensor) for user_id, tensor, error in results if error is None]
+        failed = [(user_id, error) for user_id, _, error in results if error is not None]
+
+        if ok:
+            t0 = time.perf_counter()
+            tensors = np.stack([tensor for _, tensor in ok]).astype(np.float32) / 255.0
+            embeddings = np.asarray(embed(tensors), dtype=np.float32)
+            timings['embed'] += time.perf_counter() - t0
+
+            t0 = time.perf_counter()
+            store.put_many(zip([user_id for user_id, _ in ok], embeddings))
+            timings['write'] += time.perf_counter() - t0
+
+        if failed:
+            with open(failures_path, 'a') as f:
+                for user_id, error in failed:
+                    f.write(json.dumps({'userId': user_id, 'error': error}) + '\n')
+
+        checkpoint.processed += len(batch)
+        checkpoint.enrolled += len(ok)
+        checkpoint.failed += len(failed)
+        checkpoint.save()
+        logger.info(f"Bulk enrolment: {checkpoint.processed} processed, {checkpoint.enrolled} enrolled, "
+                    f"{checkpoint.failed} failed")
+
+    # Spawned workers only import this module, never TensorFlow
+    context = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context) as pool:
+        chunksize = max(1, batch_size // (4 * (workers or os.cpu_count() or 1)))
+        pending = None
+        # Decode of the next batch runs in the pool while the current one is embedded
+        for batch in _batched(records, batch_size):
+            results = pool.map(preprocess_record, batch, chunksize=chunksize)
+            if pending is not None:
+                commit(*pending)
+            pending = (batch, results)
+        if pending is not None:
+            commit(*pending)
+
+    elapsed = time.perf_counter() - started
+    processed = checkpoint.processed - resumed_from
+    return {
+        'source': checkpoint.source,
+        'resumedFrom': resumed_from,
+        'processed': processed,
+        'enrolled': checkpoint.enrolled,
+        'failed': checkpoint.failed,
+        'elapsedSeconds': elapsed,
+        'recordsPerSecond': processed / elapsed if elapsed else 0.0,
+        'decodeWaitSeconds': timings['decode_wait'],
+        'embedSeconds': timings['embed'],
+        'writeSeconds': timings['write'],
+        'storeSize': len(store),
+        'checkpoint': checkpoint_path,
+        'failures': failures_path if checkpoint.failed else None
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Bulk-enrol voter photos into the embedding store')
+    parser.add_argument('source', help='NDJSON export or directory of <userId>.<ext> images')
+    parser.add_argument('--store', default=None, help='Embedding store directory')
+    parser.add_argument('--batch-size', type=int, default=256)
+    parser.add_argument('--workers', type=int, default=None, help='Preprocessing processes (default: CPU count)')
+    parser.add_argument('--checkpoint', default=None, help='Checkpoint file (default: inside the store directory)')
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    store = EmbeddingStore(args.store or EMBEDDING_STORE_DIR, lock_timeout=0)
+    try:
+        store.acquire_writer()
+    except RuntimeError as e:
+        parser.exit(1, f'{e}; stop the server or start the job with POST /api/bulk-enroll\n')
+    report = run(args.source, store, batch_size=args.batch_size, workers=args.workers,
+                 checkpoint_path=args.checkpoint)
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
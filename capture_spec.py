@@ -0,0 +1,93 @@
+"""Capture settings the face service advertises to clients, and their enforcement.
+
+Facenet sees a 160x160 input, so anything much larger than that is spent
+on upload, base64 decoding and image decoding for nothing. Clients fetch
+``GET /capture-spec`` and downscale before encoding. Payloads over the
+advertised size are rejected with 413 when ``CAPTURE_SPEC_ENFORCE=reject``.
+Otherwise they are accepted and oversized JPEGs are decoded at reduced
+scale straight from the DCT coefficients; photos kept on Cloudinary are
+re-encoded to the spec before upload.
+
+Every browser capture path goes through ``public/js/capture-spec.js``, and
+Node fetches Cloudinary-hosted reference images through a transformation
+that fits the face spec. References stored only as base64 in MongoDB are
+forwarded as stored, so keep the default mode until every registered
+voter has a ``faceImageUrl``; in reject mode their checks get 413.
+"""
+import os
+from io import BytesIO
+
+import cv2
+import numpy as np
+from PIL import Image
+
+CAPTURE_SPEC_ENFORCE = os.environ.get('CAPTURE_SPEC_ENFORCE', 'downscale')  # or 'reject'
+
+FACE_SPEC = {
+    'maxWidth': 320,
+    'maxHeight': 320,
+    'format': 'image/jpeg',
+    'quality': 0.85,
+    'maxImageBytes': 96 * 1024
+}
+# Kept on Cloudinary for review, so a little more detail
+PHOTO_SPEC = {
+    'maxWidth': 640,
+    'maxHeight': 640,
+    'format': 'image/jpeg',
+    'quality': 0.85,
+    'maxImageBytes': 256 * 1024
+}
+
+
+def _route_spec(base, max_images):
+    # base64 inflates by 4/3; allow some room for the rest of the JSON body
+    return {**base, 'maxImages': max_images,
+            'maxRequestBytes': max_images * (base['maxImageBytes'] * 4 // 3 + 64) + 4096}
+
+
+def build_specs(burst_max_frames):
+    return {
+        '/verify': _route_spec(FACE_SPEC, 2),
+        '/api/register': _route_spec(FACE_SPEC, 1),
+        '/verify-voting': _route_spec(FACE_SPEC, 1),
+        '/verify-voting-burst': _route_spec(FACE_SPEC, burst_max_frames),
+        '/api/upload-photo': _route_spec(PHOTO_SPEC, 1)
+    }
+
+
+_REDUCED_FLAGS = ((8, cv2.IMREAD_REDUCED_COLOR_8), (4, cv2.IMREAD_REDUCED_COLOR_4), (2, cv2.IMREAD_REDUCED_COLOR_2))
+
+
+def decode_image_bytes(raw, min_side):
+    """Decode image bytes to BGR, skipping JPEG resolution beyond what min_side needs.
+
+    The longest side of the result is at least min_side (or the original
+    size, if that is smaller). Non-JPEG images are decoded normally.
+    """
+    flags = cv2.IMREAD_COLOR
+    try:
+        with Image.open(BytesIO(raw)) as header:  # reads the header only
+            longest = max(header.size)
+            is_jpeg = header.format == 'JPEG'
+    except Exception:
+        longest, is_jpeg = 0, False
+    if is_jpeg:
+        for factor, reduced in _REDUCED_FLAGS:
+            if longest // factor >= min_side:
+                flags = reduced
+                break
+    return cv2.imdecode(np.frombuffer(raw, np.uint8), flags)
+
+
+def downscale_to_spec(raw, spec):
+    """Re-encode image bytes as a JPEG within the spec's dimensions and quality, or None if undecodable"""
+    img = decode_image_bytes(raw, max(spec['maxWidth'], spec['maxHeight']))
+    if img is None:
+        return None
+    factor = min(1.0, spec['maxWidth'] / img.shape[1], spec['maxHeight'] / img.shape[0])
+    if factor < 1.0:
+        img = cv2.resize(img, (max(1, round(img.shape[1] * factor)), max(1, round(img.shape[0] * factor))),
+                         interpolation=cv2.INTER_AREA)
+    ok, buffer = cv2.imencode('.jpg', img, [cv2.IMWRITE_JPEG_QUALITY, round(spec['quality'] * 100)])
+    return buffer.tobytes() if ok else None
@@ -0,0 +1,182 @@
+"""Calibrate the verification cascade and report what it costs in accuracy.
+
+Embeds every image of a labelled pair dataset with the cheap cascade model
+and with Facenet, then compares the cascade with always running Facenet:
+the fraction of pairs escalated, agreement with the Facenet decision,
+accuracy/FAR/FRR against the labels, and the expected inference time per
+check. Without explicit bands it picks the widest bands whose
+disagreement with Facenet stays within --tolerance, and prints the
+CASCADE_* settings for the server.
+
+The dataset is a CSV with image1,image2,label columns (label 1 when both
+images show the same person); image paths are relative to the CSV.
+
+Usage:
+    python cascade_report.py pairs.csv --model OpenFace
+    python cascade_report.py pairs.csv --model OpenFace --accept-below 0.03 --reject-above 0.2
+"""
+import argparse
+import csv
+import json
+import os
+import time
+
+import cv2
+import numpy as np
+
+from capture_spec import decode_image_bytes
+from preprocessing import resize_and_pad
+
+MATCH_PERCENTAGE_CUTOFF = 70
+
+
+def load_pairs(path):
+    base = os.path.dirname(os.path.abspath(path))
+    with open(path, newline='') as f:
+        rows = list(csv.DictReader(f))
+    first = [os.path.join(base, row['image1']) for row in rows]
+    second = [os.path.join(base, row['image2']) for row in rows]
+    labels = np.array([int(row['label']) for row in rows], dtype=bool)
+    return first, second, labels
+
+
+def load_face(path):
+    """Same decode, colour conversion and resize the server applies before inference"""
+    with open(path, 'rb') as f:
+        img = decode_image_bytes(f.read(), 160)
+    if img is None:
+        raise ValueError(f'Failed to decode {path}')
+    return resize_and_pad(cv2.cvtColor(img, cv2.COLOR_BGR2RGB))
+
+
+def embed_images(paths, model_name):
+    """Embed each distinct image once; returns {path: embedding} and mean seconds per image"""
+    from deepface import DeepFace
+    DeepFace.build_model(model_name)  # keep model construction out of the timing
+    embeddings = {}
+    elapsed = 0.0
+    for path in sorted(set(paths)):
+        face = load_face(path)
+        started = time.perf_counter()
+        embeddings[path] = np.asarray(DeepFace.represent(
+            face,
+            model_name=model_name,
+            detector_backend='skip',
+            enforce_detection=False
+        )[0]['embedding'], dtype=np.float32)
+        elapsed += time.perf_counter() - started
+    return embeddings, elapsed / max(len(embeddings), 1)
+
+
+def pair_distances(embeddings, first, second):
+    a = np.stack([embeddings[path] for path in first])
+    b = np.stack([embeddings[path] for path in second])
+    a /= np.linalg.norm(a, axis=1, keepdims=True)
+    b /= np.linalg.norm(b, axis=1, keepdims=True)
+    return 1 - np.einsum('ij,ij->i', a, b)
+
+
+def calibrate(cheap, facenet_match, tolerance):
+    """Widest accept/reject bands whose disagreement with Facenet is within tolerance, plus the match distance"""
+    order = np.argsort(cheap)
+    distances = cheap[order]
+    matches = facenet_match[order]
+    allowed = tolerance * len(cheap)
+
+    # Accepting everything up to index k wrongly accepts cumsum(~matches)[k] Facenet rejections
+    wrongly_accepted = np.cumsum(~matches)
+    ok = np.nonzero(wrongly_accepted <= allowed)[0]
+    accept_below = float(distances[ok[-1]]) if len(ok) else 0.0
+
+    # Rejecting everything from index k on wrongly rejects the Facenet matches at or after k
+    wrongly_rejected = np.cumsum(matches[::-1])[::-1]
+    ok = np.nonzero(wrongly_rejected <= allowed)[0]
+    reject_above = float(distances[ok[0]]) if len(ok) else float(distances[-1]) + 1e-6
+
+    # Single cutoff that best reproduces the Facenet decision
+    agreement = np.cumsum(matches) + (np.sum(~matches) - np.cumsum(~matches))
+    match_distance = float(distances[int(np.argmax(agreement))])
+    match_distance = min(max(match_distance, accept_below), reject_above)
+    return accept_below, reject_above, match_distance
+
+
+def rates(decision, labels):
+    return {
+        'accuracy': float(np.mean(decision == labels)),
+        'far': float(np.mean(decision[~labels])) if (~labels).any() else 0.0,
+        'frr': float(np.mean(~decision[labels])) if labels.any() else 0.0
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Calibrate and evaluate the cheap-model verification cascade')
+    parser.add_argument('pairs', help='CSV with image1,image2,label columns')
+    parser.add_argument('--model', default='OpenFace', help='Cheap DeepFace model for the first stage')
+    parser.add_argument('--accept-below', type=float, default=None)
+    parser.add_argument('--reject-above', type=float, default=None)
+    parser.add_argument('--match-distance', type=float, default=None)
+    parser.add_argument('--tolerance', type=float, default=0.0,
+                        help='Fraction of pairs allowed to disagree with Facenet when picking bands')
+    args = parser.parse_args(argv)
+
+    from deepface.commons import distance as dst
+
+    first, second, labels = load_pairs(args.pairs)
+    paths = first + second
+
+    cheap_embeddings, cheap_seconds = embed_images(paths, args.model)
+    facenet_embeddings, facenet_seconds = embed_images(paths, 'Facenet')
+    cheap = pair_distances(cheap_embeddings, first, second)
+    facenet = pair_distances(facenet_embeddings, first, second)
+
+    # The server's rule: matchPercentage >= 70, i.e. distance <= 0.3 * threshold
+    facenet_threshold = dst.findThreshold('Facenet', 'cosine')
+    facenet_match = facenet <= (1 - MATCH_PERCENTAGE_CUTOFF / 100) * facenet_threshold
+
+    accept_below, reject_above, match_distance = calibrate(cheap, facenet_match, args.tolerance)
+    if args.accept_below is not None:
+        accept_below = args.accept_below
+    if args.reject_above is not None:
+        reject_above = args.reject_above
+    if args.match_distance is not None:
+        match_distance = args.match_distance
+
+    accepted = cheap <= accept_below
+    rejected = cheap >= reject_above
+    escalated = ~(accepted | rejected)
+    cascade_match = np.where(accepted, True, np.where(rejected, False, facenet_match))
+
+    escalation = float(np.mean(escalated))
+    report = {
+        'pairs': int(len(labels)),
+        'model': args.model,
+        'bands': {
+            'acceptBelow': accept_below,
+            'rejectAbove': reject_above,
+            'matchDistance': match_distance
+        },
+        'escalationFraction': escalation,
+        'agreementWithFacenet': float(np.mean(cascade_match == facenet_match)),
+        'cascade': rates(cascade_match, labels),
+        'facenetOnly': rates(facenet_match, labels),
+        'latencyPerImageMs': {
+            args.model: cheap_seconds * 1000,
+            'Facenet': facenet_seconds * 1000
+        },
+        # Two images per check; escalated checks pay for both models
+        'inferencePerCheckMs': {
+            'cascade': 2 * (cheap_seconds + escalation * facenet_seconds) * 1000,
+            'facenetOnly': 2 * facenet_seconds * 1000
+        },
+        'serverSettings': {
+            'CASCADE_MODEL': args.model,
+            'CASCADE_ACCEPT_BELOW': accept_below,
+            'CASCADE_REJECT_ABOVE': reject_above,
+            'CASCADE_MATCH_DISTANCE': match_distance
+        }
+    }
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,30 @@
+"""Record framing and directory fsync shared by the append-only logs.
+
+embedding_store.py and audit_log.py both write records as a crc32 of the
+body followed by the body, and stop reading at the first record whose
+length runs past the data or whose checksum does not match, which is
+where a crash left the tail of the file.
+"""
+import os
+import struct
+import zlib
+
+CRC = struct.Struct('<I')
+
+
+def frame(body):
+    """body prefixed with its crc32"""
+    return CRC.pack(zlib.crc32(body)) + body
+
+
+def intact(view, offset, end):
+    """True when the record at view[offset:end] is complete and its crc32 matches"""
+    return end <= len(view) and zlib.crc32(view[offset + CRC.size:end]) == CRC.unpack_from(view, offset)[0]
+
+
+def fsync_dir(directory):
+    fd = os.open(directory, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
@@ -0,0 +1,407 @@
+"""Persistent store of reference face embeddings keyed by user ID.
+
+Every change is a (userId, embedding, version) record appended to a log.
+Concurrent writers are group-committed: a single writer thread appends
+whatever has queued up and fsyncs once for the whole group. Periodically
+the live embeddings are written to a compacted snapshot and the log
+starts a new segment, so a restart loads the latest snapshot and replays
+only the segment written after it. Re-registration and deletion are
+single appends.
+
+Point ``EMBEDDING_STORE_DIR`` at a persistent volume; the default lives
+in the working directory. Any number of processes may open a directory
+to read it, but only one may write: the first write takes an exclusive
+lock on the directory, so the server, its workers and the bulk_enroll
+CLI never append to the same log. A process that gets the lock after
+another writer has changed the log reloads first. A forked child
+(gunicorn ``--preload``) never inherits its parent's lock; it reloads
+from disk on first use and takes the lock itself on its first write.
+
+Layout of ``EMBEDDING_STORE_DIR``:
+    LOCK                 held by the writing process
+    snapshot-<lsn>.npz   live ids, embeddings and versions as of <lsn>
+    log-<lsn>.wal        records with version >= <lsn>
+"""
+import fcntl
+import glob
+import logging
+import os
+import struct
+import threading
+import time
+import weakref
+
+import numpy as np
+
+from crc_log import frame, fsync_dir, intact
+
+logger = logging.getLogger(__name__)
+
+EMBEDDING_STORE_DIR = os.environ.get('EMBEDDING_STORE_DIR', os.path.join(os.getcwd(), 'embedding_store'))
+EMBEDDING_DIM = 128  # Facenet
+GROUP_COMMIT_INTERVAL = float(os.environ.get('EMBEDDING_GROUP_COMMIT_MS', 2)) / 1000
+SNAPSHOT_EVERY = int(os.environ.get('EMBEDDING_SNAPSHOT_EVERY', 100000))  # records since the last snapshot
+# How long to wait for another process to release the directory, e.g. a recycled worker still exiting
+LOCK_TIMEOUT = float(os.environ.get('EMBEDDING_STORE_LOCK_TIMEOUT', 30))
+
+OP_PUT = 1
+OP_DELETE = 2
+# crc32 of everything after it, op, version, id length; then id bytes and, for puts, the embedding
+RECORD_HEADER = struct.Struct('<IBQH')
+EMBEDDING_BYTES = EMBEDDING_DIM * 4
+
+
+def encode_record(op, version, user_id, embedding=None):
+    id_bytes = user_id.encode('utf-8')
+    body = RECORD_HEADER.pack(0, op, version, len(id_bytes))[4:] + id_bytes
+    if op == OP_PUT:
+        body += np.asarray(embedding, dtype='<f4').tobytes()
+    return frame(body)
+
+
+def iter_records(data):
+    """Yield (offset, end, op, version, user_id, embedding) until the data ends or a record is torn/corrupt"""
+    view = memoryview(data)
+    offset = 0
+    while offset + RECORD_HEADER.size <= len(data):
+        _, op, version, id_len = RECORD_HEADER.unpack_from(data, offset)
+        id_end = offset + RECORD_HEADER.size + id_len
+        end = id_end + (EMBEDDING_BYTES if op == OP_PUT else 0)
+        if op not in (OP_PUT, OP_DELETE) or not intact(view, offset, end):
+            return
+        user_id = bytes(view[offset + RECORD_HEADER.size:id_end]).decode('utf-8')
+        embedding = np.frombuffer(data, dtype='<f4', count=EMBEDDING_DIM, offset=id_end) if op == OP_PUT else None
+        yield offset, end, op, version, user_id, embedding
+        offset = end
+
+
+def _lock_directory(directory, timeout):
+    """Open file holding an exclusive lock on directory, waiting up to timeout seconds for it"""
+    lock_file = open(os.path.join(directory, 'LOCK'), 'a+')
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+            break
+        except BlockingIOError:
+            if time.monotonic() >= deadline:
+                lock_file.seek(0)
+                owner = lock_file.read().strip() or 'unknown'
+                lock_file.close()
+                raise RuntimeError(f'Embedding store {directory} is in use by another process (pid {owner})')
+            time.sleep(0.1)
+    lock_file.seek(0)
+    lock_file.truncate()
+    lock_file.write(str(os.getpid()))
+    lock_file.flush()
+    return lock_file
+
+
+class EmbeddingStore:
+    def __init__(self, directory=EMBEDDING_STORE_DIR, group_commit_interval=GROUP_COMMIT_INTERVAL,
+                 snapshot_every=SNAPSHOT_EVERY, lock_timeout=LOCK_TIMEOUT):
+        self.directory = directory
+        self.group_commit_interval = group_commit_interval
+        self.snapshot_every = snapshot_every
+        self.lock_timeout = lock_timeout
+        os.makedirs(directory, exist_ok=True)
+
+        self._init_locks()
+        self._open()
+
+        # The writer thread and the directory lock belong to this process, and the parent's index may be
+        # behind the log by the time a child is forked (gunicorn --preload forks workers from the master)
+        store = weakref.ref(self)
+        os.register_at_fork(after_in_child=lambda: store() is not None and store()._after_fork())
+
+    def _init_locks(self):
+        self._lock = threading.RLock()  # index, matrix and pending records
+        self._committed = threading.Condition(self._lock)
+        self._io_lock = threading.Lock()  # the open log segment
+        self._snapshot_lock = threading.Lock()
+        self._owner_lock = threading.Lock()  # taking the directory lock
+        self._lock_file = None  # held from the first write
+        self._log = None
+        self._writer = None  # started on the first write
+        self._stale = False
+
+    def _init_data(self):
+        self._index = {}
+        self._free_rows = []
+        self._matrix = np.empty((1024, EMBEDDING_DIM), dtype=np.float32)
+        self._versions = np.zeros(1024, dtype=np.uint64)
+        self._size = 0  # rows ever used
+
+        self._pending = []
+        self._version = 0  # last assigned
+        self._durable_version = 0
+        self._since_snapshot = 0
+        self._error = None
+        self._closed = False
+        self._torn_tail = False
+
+    def _open(self, truncate=False):
+        started = time.perf_counter()
+        self._init_data()
+        self._load(truncate)
+        self.load_seconds = time.perf_counter() - started
+        logger.info(f"Embedding store loaded {len(self._index)} embeddings in {self.load_seconds:.2f}s "
+                    f"({self._since_snapshot} log records replayed)")
+
+    def _after_fork(self):
+        # The inherited lock and log stay with the parent; dropping them closes only this process's copies
+        self._init_locks()
+        self._stale = True
+
+    def _refresh(self):
+        """Reload from disk on first use in a forked child"""
+        if not self._stale:
+            return
+        with self._lock:
+            if self._stale:
+                self._open()
+                self._stale = False
+
+    def _disk_state(self):
+        return sorted((os.path.basename(path), os.path.getsize(path))
+                      for path in glob.glob(os.path.join(self.directory, 'snapshot-*.npz')) +
+                      glob.glob(os.path.join(self.directory, 'log-*.wal')))
+
+    def acquire_writer(self):
+        """Take the directory lock for this process's writes, waiting up to lock_timeout for another writer.
+
+        Reloads first when another writer changed the log since it was loaded. Raises RuntimeError when
+        the directory is still locked after lock_timeout.
+        """
+        self._refresh()
+        if self._lock_file is not None:
+            return
+        with self._owner_lock:
+            if self._lock_file is not None:
+                return
+            lock_file = _lock_directory(self.directory, self.lock_timeout)
+            with self._lock:
+                if self._torn_tail or self._disk_state() != self._loaded_state:
+                    self._open(truncate=True)
+                self._log = open(self._segment_path, 'ab')
+                self._lock_file = lock_file
+
+    # Loading
+
+    def _load(self, truncate):
+        """Load the latest snapshot and replay the log; only the writer (truncate=True) cuts a torn tail"""
+        snapshots = sorted(glob.glob(os.path.join(self.directory, 'snapshot-*.npz')))
+        snapshot_version = 0
+        if snapshots:
+            with np.load(snapshots[-1]) as snapshot:
+                ids = [user_id.decode('utf-8') for user_id in snapshot['ids'].tolist()]
+                embeddings = snapshot['embeddings']
+                versions = snapshot['versions']
+                snapshot_version = int(snapshot['version'])
+            self._reserve(len(ids))
+            self._matrix[:len(ids)] = embeddings
+            self._versions[:len(ids)] = versions
+            self._size = len(ids)
+            self._index = dict(zip(ids, range(len(ids))))
+        self._version = self._durable_version = snapshot_version
+
+        segments = sorted(glob.glob(os.path.join(self.directory, 'log-*.wal')))
+        for i, path in enumerate(segments):
+            with open(path, 'rb') as f:
+                data = f.read()
+            end = 0
+            for _, end, op, version, user_id, embedding in iter_records(data):
+                if version <= snapshot_version:
+                    continue
+                self._apply(op, version, user_id, embedding)
+                self._version = version
+                self._since_snapshot += 1
+            if end != len(data) and i == len(segments) - 1:
+                # Also what a reader sees of a group the writer is still appending
+                self._torn_tail = True
+                if truncate:
+                    logger.warning(f"Discarding {len(data) - end} bytes of torn log tail in {path}")
+                    with open(path, 'r+b') as f:
+                        f.truncate(end)
+            elif end != len(data):
+                logger.warning(f"Ignoring {len(data) - end} bytes of torn log tail in {path}")
+        self._durable_version = self._version
+        self._loaded_state = self._disk_state()
+
+        if segments and int(os.path.basename(segments[-1])[4:-4]) > snapshot_version:
+            self._segment_path = segments[-1]
+        else:
+            self._segment_path = os.path.join(self.directory, f'log-{self._version + 1:016d}.wal')
+
+    def _reserve(self, rows):
+        if rows <= len(self._matrix):
+            return
+        capacity = max(rows, 2 * len(self._matrix))
+        matrix = np.empty((capacity, EMBEDDING_DIM), dtype=np.float32)
+        matrix[:self._size] = self._matrix[:self._size]
+        versions = np.zeros(capacity, dtype=np.uint64)
+        versions[:self._size] = self._versions[:self._size]
+        self._matrix, self._versions = matrix, versions
+
+    def _apply(self, op, version, user_id, embedding):
+        row = self._index.get(user_id)
+        if op == OP_DELETE:
+            if row is not None:
+                del self._index[user_id]
+                self._free_rows.append(row)
+            return
+        if row is None:
+            if self._free_rows:
+                row = self._free_rows.pop()
+            else:
+                self._reserve(self._size + 1)
+                row = self._size
+                self._size += 1
+            self._index[user_id] = row
+        self._matrix[row] = embedding
+        self._versions[row] = version
+
+    # Writing
+
+    def _append(self, records):
+        """Queue (op, user_id, embedding) records, apply them in memory and wait until they are durable"""
+        self.acquire_writer()
+        with self._lock:
+            if self._closed:
+                raise RuntimeError('Embedding store is closed')
+            if self._writer is None:
+                self._writer = threading.Thread(target=self._write_loop, name='embedding-store-writer', daemon=True)
+                self._writer.start()
+            for op, user_id, embedding in records:
+                self._version += 1
+                self._pending.append(encode_record(op, self._version, user_id, embedding))
+                self._apply(op, self._version, user_id, embedding)
+            version = self._version
+            self._committed.notify_all()
+            while self._durable_version < version and self._error is None:
+                self._committed.wait()
+            if self._error is not None:
+                raise RuntimeError(f'Embedding store write failed: {self._error}')
+        return version
+
+    def _flush(self):
+        """Write and fsync everything pending as one group; caller holds _io_lock"""
+        with self._lock:
+            batch, version = self._pending, self._version
+            self._pending = []
+        if batch:
+            self._log.write(b''.join(batch))
+            self._log.flush()
+            os.fsync(self._log.fileno())
+        with self._lock:
+            self._durable_version = version
+            self._since_snapshot += len(batch)
+            self._committed.notify_all()
+
+    def _write_loop(self):
+        while True:
+            with self._lock:
+                while not self._pending and not self._closed:
+                    self._committed.wait()
+                if self._closed and not self._pending:
+                    return
+            # Let concurrent writers join this group before the fsync
+            if self.group_commit_interval:
+                time.sleep(self.group_commit_interval)
+            try:
+                with self._io_lock:
+                    self._flush()
+            except Exception as e:
+                logger.error(f"Embedding store write error: {str(e)}")
+                with self._lock:
+                    self._error = e
+                    self._committed.notify_all()
+                return
+            if self.snapshot_every and self._since_snapshot >= self.snapshot_every and not self._snapshot_lock.locked():
+                threading.Thread(target=self.snapshot, name='embedding-store-snapshot', daemon=True).start()
+
+    def put_many(self, items):
+        """Store (user_id, embedding) pairs as a single group commit"""
+        records = [(OP_PUT, str(user_id), np.asarray(embedding, dtype=np.float32)) for user_id, embedding in items]
+        if records:
+            self._append(records)
+        return len(records)
+
+    def put(self, user_id, embedding):
+        return self.put_many([(user_id, embedding)])
+
+    def delete(self, user_id):
+        self.acquire_writer()  # so the check below sees the latest log
+        user_id = str(user_id)
+        if user_id not in self._index:
+            return False
+        self._append([(OP_DELETE, user_id, None)])
+        return True
+
+    def snapshot(self):
+        """Write a compacted snapshot, start a new log segment and drop what the snapshot replaces"""
+        self.acquire_writer()
+        with self._snapshot_lock:
+            with self._io_lock:
+                self._flush()
+                with self._lock:
+                    version = self._version
+                    ids = list(self._index.keys())
+                    rows = np.fromiter(self._index.values(), dtype=np.int64, count=len(ids))
+                    embeddings = self._matrix[rows]
+                    versions = self._versions[rows]
+                    self._since_snapshot = 0
+                self._log.close()
+                self._segment_path = os.path.join(self.directory, f'log-{version + 1:016d}.wal')
+                self._log = open(self._segment_path, 'ab')
+
+            path = os.path.join(self.directory, f'snapshot-{version:016d}.npz')
+            tmp_path = path + '.tmp'
+            with open(tmp_path, 'wb') as f:
+                np.savez(f, ids=np.array([user_id.encode('utf-8') for user_id in ids], dtype=bytes),
+                         embeddings=embeddings, versions=versions, version=np.uint64(version))
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, path)
+            fsync_dir(self.directory)
+
+            for old in glob.glob(os.path.join(self.directory, 'snapshot-*.npz')) + \
+                    glob.glob(os.path.join(self.directory, 'log-*.wal')):
+                if old != path and old != self._segment_path:
+                    os.remove(old)
+            logger.info(f"Embedding store snapshot at version {version} with {len(ids)} embeddings")
+            return path
+
+    def close(self):
+        with self._lock:
+            self._closed = True
+            self._committed.notify_all()
+        if self._writer is not None:
+            self._writer.join()
+        with self._io_lock:
+            if self._log is not None:
+                self._log.close()
+        if self._lock_file is not None:
+            self._lock_file.close()
+
+    # Reading
+
+    def get(self, user_id):
+        self._refresh()
+        with self._lock:
+            row = self._index.get(str(user_id))
+            return None if row is None else self._matrix[row].copy()
+
+    def version_of(self, user_id):
+        self._refresh()
+        with self._lock:
+            row = self._index.get(str(user_id))
+            return None if row is None else int(self._versions[row])
+
+    def __contains__(self, user_id):
+        self._refresh()
+        return str(user_id) in self._index
+
+    def __len__(self):
+        self._refresh()
+        return len(self._index)
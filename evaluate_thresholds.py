@@ -0,0 +1,224 @@
+"""Evaluate the verification decision rules against labelled pairs.
+
+The service has two rules over the cosine distance of Facenet embeddings:
+
+    /verify          matchPercentage = (1 - distance / threshold) * 100 >= 70,
+                     with DeepFace's threshold for the model
+    /verify-voting   similarity = 1 - distance > 0.6 (also the burst route)
+
+For each inference setting this embeds every image of a pair dataset once
+and caches the embeddings and per-image timings. It then computes the
+FAR/FRR curve of each rule over its whole parameter range, the ROC AUC
+and equal error rate, the current operating points, and the parameter
+that meets --target-far. Accuracy is reported next to per-image latency,
+so a faster setting is judged on both.
+
+A setting is model:detector:decode, e.g. Facenet:skip:160 is what the
+server runs (pre-cropped faces, JPEGs decoded at reduced scale down to
+160px); Facenet:opencv:0 detects faces in full-resolution decodes.
+
+The dataset is a CSV with image1,image2,label columns as for
+cascade_report.py.
+
+Usage:
+    python evaluate_thresholds.py pairs.csv
+    python evaluate_thresholds.py pairs.csv --setting Facenet:skip:160 --setting Facenet:opencv:0 \\
+        --curves curves.csv
+"""
+import argparse
+import csv
+import json
+import os
+import time
+
+import cv2
+import numpy as np
+
+from capture_spec import decode_image_bytes
+from cascade_report import MATCH_PERCENTAGE_CUTOFF, load_pairs, pair_distances, rates
+from preprocessing import resize_and_pad
+
+VOTING_THRESHOLD = 0.6
+CUTOFF_GRID = np.linspace(0, 100, 201)  # verify_face matchPercentage cutoffs
+SIMILARITY_GRID = np.linspace(0, 1, 201)  # verify_voting similarity thresholds
+DEFAULT_CACHE_DIR = os.path.join(os.getcwd(), 'temp', 'eval_cache')
+
+
+def parse_setting(text):
+    model, detector, decode = (text.split(':') + ['skip', '160'])[:3]
+    return {'name': f'{model}:{detector}:{decode}', 'model': model, 'detector': detector, 'decode': int(decode)}
+
+
+def load_image(path, decode):
+    """RGB image as the server sees it; decode 0 means full resolution"""
+    with open(path, 'rb') as f:
+        raw = f.read()
+    img = decode_image_bytes(raw, decode) if decode else cv2.imdecode(np.frombuffer(raw, np.uint8), cv2.IMREAD_COLOR)
+    if img is None:
+        raise ValueError(f'Failed to decode {path}')
+    return cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
+
+
+def _file_key(path):
+    stat = os.stat(path)
+    return f'{path}|{stat.st_size}|{stat.st_mtime_ns}'
+
+
+def embed_cached(paths, setting, cache_dir, refresh=False):
+    """Embeddings for every distinct path, reusing the cache for unchanged files.
+
+    Returns {path: embedding}, the seconds each image took (preprocessing
+    and inference, model construction excluded) when it was embedded, and
+    how many images were embedded in this run.
+    """
+    cache_path = os.path.join(cache_dir, setting['name'].replace(':', '_') + '.npz')
+    cached = {}
+    if os.path.exists(cache_path) and not refresh:
+        with np.load(cache_path) as cache:
+            for key, embedding, seconds in zip(cache['keys'].tolist(), cache['embeddings'], cache['seconds']):
+                cached[key] = (embedding, float(seconds))
+
+    keys = {path: _file_key(path) for path in sorted(set(paths))}
+    missing = [path for path, key in keys.items() if key not in cached]
+    if missing:
+        from deepface import DeepFace
+        DeepFace.build_model(setting['model'])  # keep model construction out of the timing
+        for path in missing:
+            started = time.perf_counter()
+            img = load_image(path, setting['decode'])
+            if setting['detector'] == 'skip':
+                img = resize_and_pad(img)
+            embedding = DeepFace.represent(
+                img,
+                model_name=setting['model'],
+                detector_backend=setting['detector'],
+                enforce_detection=False
+            )[0]['embedding']
+            cached[keys[path]] = (np.asarray(embedding, dtype=np.float32), time.perf_counter() - started)
+
+        os.makedirs(cache_dir, exist_ok=True)
+        entries = [(key, *cached[key]) for key in keys.values()]
+        np.savez(
+            cache_path,
+            keys=np.array([key for key, _, _ in entries]),
+            embeddings=np.stack([embedding for _, embedding, _ in entries]),
+            seconds=np.array([seconds for _, _, seconds in entries])
+        )
+
+    embeddings = {path: cached[key][0] for path, key in keys.items()}
+    seconds = np.array([cached[key][1] for key in keys.values()])
+    return embeddings, seconds, len(missing)
+
+
+def error_rates(distances, labels, cutoffs, inclusive=True):
+    """FAR and FRR when pairs are accepted at distance <= cutoff (or < cutoff), for every cutoff at once"""
+    side = 'right' if inclusive else 'left'
+    impostor = np.sort(distances[~labels])
+    genuine = np.sort(distances[labels])
+    far = np.searchsorted(impostor, cutoffs, side=side) / max(len(impostor), 1)
+    frr = 1 - np.searchsorted(genuine, cutoffs, side=side) / max(len(genuine), 1)
+    return far, frr
+
+
+def roc_auc(distances, labels):
+    """Area under the ROC curve, with every observed distance as a threshold"""
+    cutoffs = np.concatenate(([-np.inf], np.unique(distances)))
+    far, frr = error_rates(distances, labels, cutoffs)
+    tpr = 1 - frr
+    return float(np.sum(np.diff(far) * (tpr[1:] + tpr[:-1]) / 2))
+
+
+def equal_error(param, far, frr):
+    i = int(np.argmin(np.abs(far - frr)))
+    return float((far[i] + frr[i]) / 2), float(param[i])
+
+
+def at_target_far(param, far, frr, target):
+    """Parameter with the lowest FRR whose FAR is within target"""
+    ok = np.nonzero(far <= target)[0]
+    if not len(ok):
+        return None
+    i = ok[np.argmin(frr[ok])]
+    return {'value': float(param[i]), 'far': float(far[i]), 'frr': float(frr[i])}
+
+
+def evaluate_rule(name, param, current, to_cutoff, inclusive, distances, labels, target_far):
+    """Operating point, EER and curve of a rule whose parameter maps to a distance cutoff via to_cutoff"""
+    far, frr = error_rates(distances, labels, to_cutoff(param), inclusive)
+    current_cutoff = to_cutoff(current)
+    accepted = distances <= current_cutoff if inclusive else distances < current_cutoff
+    eer, eer_param = equal_error(param, far, frr)
+    summary = {
+        name: current,
+        'distanceCutoff': float(current_cutoff),
+        **rates(accepted, labels),
+        'eer': eer,
+        f'{name}AtEer': eer_param,
+        f'{name}AtTargetFar': at_target_far(param, far, frr, target_far)
+    }
+    return summary, far, frr
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='FAR/FRR and latency of the verification rules per inference setting')
+    parser.add_argument('pairs', help='CSV with image1,image2,label columns')
+    parser.add_argument('--setting', action='append', default=None,
+                        help='model:detector:decode (repeatable); default Facenet:skip:160')
+    parser.add_argument('--cache-dir', default=DEFAULT_CACHE_DIR)
+    parser.add_argument('--refresh', action='store_true', help='Re-embed everything and re-measure latency')
+    parser.add_argument('--target-far', type=float, default=0.001)
+    parser.add_argument('--curves', help='Write every curve point to this CSV')
+    args = parser.parse_args(argv)
+
+    from deepface.commons import distance as dst
+
+    first, second, labels = load_pairs(args.pairs)
+    settings = [parse_setting(text) for text in (args.setting or ['Facenet:skip:160'])]
+
+    reports = []
+    curve_rows = []
+    for setting in settings:
+        embeddings, seconds, embedded = embed_cached(first + second, setting, args.cache_dir, args.refresh)
+        distances = pair_distances(embeddings, first, second)
+        threshold = dst.findThreshold(setting['model'], 'cosine')
+
+        # verify_face accepts when (1 - d / threshold) * 100 >= cutoff, i.e. d <= (1 - cutoff / 100) * threshold
+        verify_face, face_far, face_frr = evaluate_rule(
+            'matchPercentageCutoff', CUTOFF_GRID, MATCH_PERCENTAGE_CUTOFF,
+            lambda cutoff: (1 - cutoff / 100) * threshold, True, distances, labels, args.target_far)
+        verify_face['modelThreshold'] = threshold
+        # verify_voting accepts when 1 - d > similarity threshold, i.e. d < 1 - threshold
+        verify_voting, voting_far, voting_frr = evaluate_rule(
+            'similarityThreshold', SIMILARITY_GRID, VOTING_THRESHOLD,
+            lambda similarity: 1 - similarity, False, distances, labels, args.target_far)
+
+        reports.append({
+            'setting': setting['name'],
+            'pairs': int(len(labels)),
+            'images': int(len(seconds)),
+            'embeddedThisRun': embedded,
+            'latencyPerImageMs': {
+                'mean': float(np.mean(seconds) * 1000),
+                'p50': float(np.percentile(seconds, 50) * 1000),
+                'p95': float(np.percentile(seconds, 95) * 1000)
+            },
+            'rocAuc': roc_auc(distances, labels),
+            'verifyFace': verify_face,
+            'verifyVoting': verify_voting
+        })
+        for rule, param, far, frr in (('verify_face', CUTOFF_GRID, face_far, face_frr),
+                                      ('verify_voting', SIMILARITY_GRID, voting_far, voting_frr)):
+            curve_rows.extend(zip([setting['name']] * len(param), [rule] * len(param),
+                                  param.tolist(), far.tolist(), frr.tolist()))
+
+    if args.curves:
+        with open(args.curves, 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(['setting', 'rule', 'parameter', 'far', 'frr'])
+            writer.writerows(curve_rows)
+
+    print(json.dumps({'targetFar': args.target_far, 'settings': reports}, indent=2))
+
+
+if __name__ == '__main__':
+    main()
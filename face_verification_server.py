@@ -18,11 +18,13 @@ if gpus:
     except RuntimeError as e:
         print(e)
 
-from flask import Flask, request, jsonify, send_file, send_from_directory
+from flask import Flask, request, jsonify, send_file, send_from_directory, g
 from werkzeug.utils import secure_filename
 from deepface import DeepFace
+from deepface.commons import distance as dst
 import numpy as np
 import base64
+import binascii
 import cv2
 import os
 from datetime import datetime
@@ -42,6 +44,24 @@ import tempfile
 import traceback
 import queue
 import concurrent.futures
+import contextvars
+import atexit
+import hmac
+import uuid
+import glob
+import request_profiler
+import tracing
+import capture_spec
+import alloc_tracker
+import bulk_enroll
+import preprocessing
+import verification_tickets
+import serving_graph
+import preprocess_pool
+from embedding_store import EmbeddingStore
+from audit_log import AuditLog
+from tracing import span
+from preprocess_pool import prefetch_images
 
 # Configure logging
 logging.basicConfig(
@@ -56,6 +76,9 @@ if not os.path.exists(temp_dir):
     os.makedirs(temp_dir)
     logger.info(f"Created temp directory: {temp_dir}")
 
+# Per-request profiles requested with the X-Debug-Profile header; the newest PROFILING_MAX_FILES are kept
+profile_dir = os.path.join(temp_dir, 'profiles')
+
 app = Flask(__name__)
 
 # Global OPTIONS handler
@@ -64,19 +87,87 @@ def handle_preflight():
     if request.method == "OPTIONS":
         response = jsonify({"status": "ok"})
         response.headers.add("Access-Control-Allow-Origin", "*")
-        response.headers.add("Access-Control-Allow-Headers", "Content-Type,Authorization,Accept")
-        response.headers.add("Access-Control-Allow-Methods", "GET,POST,OPTIONS")
+        response.headers.add("Access-Control-Allow-Headers", "Content-Type,Authorization,Accept,X-Request-Id,X-Verification-Ticket,X-Device-Id")
+        response.headers.add("Access-Control-Allow-Methods", "GET,POST,DELETE,OPTIONS")
         response.headers.add("Access-Control-Max-Age", "3600")
         return response
 
+@app.before_request
+def start_request_trace():
+    g.trace, g.trace_token = tracing.start_trace(request.headers, f"{request.method} {request.path}")
+
+@app.after_request
+def finish_request_trace(response):
+    trace = g.pop('trace', None)
+    if trace is not None:
+        response.headers[tracing.TRACE_HEADER] = trace.trace_id
+        tracing.finish_trace(trace, g.pop('trace_token'), status=response.status_code)
+    return response
+
+@app.teardown_request
+def teardown_request_trace(error=None):
+    # Only reached with a trace still open when the view raised
+    trace = g.pop('trace', None)
+    if trace is not None:
+        tracing.finish_trace(trace, g.pop('trace_token'), status=500, error=str(error))
+
+@app.before_request
+def enforce_capture_spec():
+    spec = CAPTURE_SPECS.get(request.path)
+    if spec is None or request.method != 'POST' or not request.content_length:
+        return None
+    if request.content_length <= spec['maxRequestBytes']:
+        return None
+    if capture_spec.CAPTURE_SPEC_ENFORCE == 'reject':
+        return jsonify({
+            'success': False,
+            'message': 'Payload exceeds the capture spec; downscale images before upload',
+            'captureSpec': spec
+        }), 413
+    logger.warning(f"{request.path} payload of {request.content_length} bytes exceeds capture spec "
+                   f"({spec['maxRequestBytes']} bytes); downscaling server-side")
+    return None
+
+# Per-request allocation tracking (diagnostic; see alloc_tracker.py)
+allocation_tracker = alloc_tracker.AllocationTracker(native_probes={
+    'tensorflow': lambda: tf.config.experimental.get_memory_info('CPU:0')['current']
+})
+if alloc_tracker.ALLOC_TRACKING:
+    allocation_tracker.start()
+
+@app.before_request
+def begin_allocation_tracking():
+    if allocation_tracker.enabled and not request.path.startswith('/debug/allocations'):
+        g.alloc_before = allocation_tracker.begin_request()
+
+@app.teardown_request
+def end_allocation_tracking(error=None):
+    before = g.pop('alloc_before', None)
+    if before is not None:
+        route = request.url_rule.rule if request.url_rule else request.path
+        allocation_tracker.end_request(f"{request.method} {route}", before)
+
 # Backend API configuration with better error handling
 BACKEND_URL = os.environ.get('BACKEND_URL', 'https://voter-verify-backend-ry3f.onrender.com')
 BACKEND_API_KEY = os.environ.get('BACKEND_API_KEY', 'your-api-key')
 
+# Guards the admin and debug endpoints; when unset they reject every request
+ADMIN_API_KEY = os.environ.get('ADMIN_API_KEY', '')
+
+def has_valid_admin_key():
+    """Check the X-API-Key header against ADMIN_API_KEY"""
+    api_key = request.headers.get('X-API-Key', '')
+    if not ADMIN_API_KEY or not api_key:
+        return False
+    return hmac.compare_digest(api_key.encode('utf-8'), ADMIN_API_KEY.encode('utf-8'))
+
 # Global variables for memory management
 request_queue = Queue(maxsize=1)  # Limit concurrent requests
 models_initialized = False  # Global variable for model initialization status
 model_lock = threading.Lock()
+# Facenet embedding function from the exported serving graph (see serving_graph.py), when there is one
+facenet_graph = None
+model_startup = {}
 executor = ThreadPoolExecutor(max_workers=1)  # Single worker thread pool
 
 # Set DeepFace model directory to a writable location
@@ -86,6 +177,90 @@ os.makedirs(os.path.join(DEEPFACE_DIR, '.deepface', 'weights'), exist_ok=True)
 os.environ['DEEPFACE_HOME'] = DEEPFACE_DIR
 logger.info(f"DeepFace directory set to: {DEEPFACE_DIR}")
 
+# Reference embeddings for registered voters, backed by an append-only log
+embedding_store = EmbeddingStore()
+# Bulk enrolment jobs are kept on disk, so their status outlives the worker that ran them
+bulk_jobs_dir = os.path.join(embedding_store.directory, 'bulk-jobs')
+os.makedirs(bulk_jobs_dir, exist_ok=True)
+bulk_lock = threading.Lock()
+bulk_resume_checked = False
+
+# Every verification decision, recorded off the request path
+audit_log = AuditLog()
+atexit.register(audit_log.close)
+
+def audit_decision(voter_id, distance, threshold, match_percentage, verified, model=None, image_url=None):
+    audit_log.record(
+        request.path,
+        voter_id,
+        distance,
+        threshold,
+        match_percentage,
+        verified,
+        model=model,
+        request_id=tracing.current_trace_id(),
+        image_url=image_url
+    )
+
+# Tickets issued after a successful match let repeat checks in the same booth visit skip inference
+ticket_store = verification_tickets.TicketStore()
+
+def request_device_id(data):
+    return request.headers.get(verification_tickets.DEVICE_HEADER) or data.get('deviceId')
+
+def ticket_response(data):
+    """Response for a check satisfied by a valid verification ticket, or None to run the full check"""
+    ticket = request.headers.get(verification_tickets.TICKET_HEADER) or data.get('ticket')
+    device_id = request_device_id(data)
+    if not ticket or not device_id:
+        return None
+    with span('ticket_check'):
+        entry = ticket_store.redeem(ticket, data.get('voterId'), device_id)
+    if entry is None:
+        logger.info(f"Verification ticket rejected for voter {data.get('voterId')}; running full check")
+        return None
+    decision = entry['decision']
+    audit_decision(entry['voterId'], None, None, decision.get('matchPercentage'), True, model='ticket',
+                   image_url=decision.get('imageUrl'))
+    # The presented ticket is spent; the next check in this visit gets a new one with the same expiry
+    ticket, expires_at = ticket_store.issue(entry['voterId'], device_id, decision, expires_at=entry['expiresAt'])
+    return jsonify({
+        **decision,
+        'ticket': ticket,
+        'ticketExpiresAt': expires_at,
+        'fromTicket': True
+    })
+
+def issue_ticket(data, decision):
+    """Ticket fields for a successful match response; none without a device ID to bind to"""
+    device_id = request_device_id(data)
+    if not device_id:
+        return {}
+    ticket, expires_at = ticket_store.issue(data['voterId'], device_id, decision)
+    return {
+        'ticket': ticket,
+        'ticketExpiresAt': expires_at,
+        'fromTicket': False
+    }
+
+# Optional two-stage cascade: a cheaper model settles clear matches and clear
+# mismatches, and only pairs near the 70% boundary reach Facenet. Calibrate the
+# distances with cascade_report.py; the cascade is off unless CASCADE_MODEL and both
+# bands are set, since the default bands would send almost every pair to Facenet.
+MATCH_PERCENTAGE_CUTOFF = 70
+CASCADE_MODEL = os.environ.get('CASCADE_MODEL', '')
+CASCADE_ACCEPT_BELOW = float(os.environ.get('CASCADE_ACCEPT_BELOW', 0))
+CASCADE_REJECT_ABOVE = float(os.environ.get('CASCADE_REJECT_ABOVE', 1))
+# Cheap-model distance equivalent to Facenet's 70% cutoff
+CASCADE_MATCH_DISTANCE = float(os.environ.get('CASCADE_MATCH_DISTANCE', (CASCADE_ACCEPT_BELOW + CASCADE_REJECT_ABOVE) / 2))
+if CASCADE_MODEL and not ('CASCADE_ACCEPT_BELOW' in os.environ and 'CASCADE_REJECT_ABOVE' in os.environ):
+    logger.error("Cascade disabled: CASCADE_MODEL is set without calibrated bands; set CASCADE_ACCEPT_BELOW "
+                 "and CASCADE_REJECT_ABOVE from the serverSettings printed by cascade_report.py")
+    CASCADE_MODEL = ''
+elif CASCADE_MODEL and not CASCADE_ACCEPT_BELOW <= CASCADE_MATCH_DISTANCE < CASCADE_REJECT_ABOVE:
+    logger.error("Cascade disabled: need CASCADE_ACCEPT_BELOW <= CASCADE_MATCH_DISTANCE < CASCADE_REJECT_ABOVE")
+    CASCADE_MODEL = ''
+
 def manage_memory():
     """Aggressive memory management"""
     try:
@@ -129,6 +304,7 @@ def manage_memory():
 
 def initialize_models_at_startup():
     """Initialize models with minimal settings"""
+    global facenet_graph, model_startup
     try:
         logger.info("Starting model initialization...")
         
@@ -142,12 +318,30 @@ def initialize_models_at_startup():
         tf.config.threading.set_inter_op_parallelism_threads(1)
         tf.config.threading.set_intra_op_parallelism_threads(1)
         
+        # Prefer the exported graph: no Keras model construction and no tracing on first use
+        warmup = np.zeros((1, *serving_graph.FACENET_INPUT_SHAPE), dtype=np.float32)
+        started = time.perf_counter()
+        try:
+            embed = serving_graph.load(DEEPFACE_DIR)
+            if embed is not None:
+                embed(warmup)
+                facenet_graph = embed
+                model_startup = {'source': 'serving_graph', 'timeToFirstInferenceSeconds': time.perf_counter() - started}
+                logger.info(f"Facenet serving graph ready in {model_startup['timeToFirstInferenceSeconds']:.2f}s")
+                return True
+            logger.info("No serving graph for the current Facenet weights; building the model with DeepFace")
+        except Exception as e:
+            logger.warning(f"Serving graph load failed, building the model with DeepFace: {str(e)}")
+        
         # Initialize DeepFace models with minimal settings
         try:
             # First try to load from cache
             model = DeepFace.build_model("Facenet")
             if model is None:
                 raise Exception("Failed to load model from cache")
+            model.predict(warmup, verbose=0)
+            model_startup = {'source': 'deepface', 'timeToFirstInferenceSeconds': time.perf_counter() - started}
+            logger.info(f"Facenet model ready in {model_startup['timeToFirstInferenceSeconds']:.2f}s")
             
             # Test with minimal image
             test_image = np.zeros((16, 16, 3), dtype=np.uint8)
@@ -173,47 +367,85 @@ def initialize_models_at_startup():
     finally:
         manage_memory()
 
+class InferenceUnavailable(Exception):
+    """No inference slot or model for this request; carries the HTTP status to return"""
+
+    def __init__(self, message, status):
+        super().__init__(message)
+        self.status = status
+
+def run_inference(func, *args, **kwargs):
+    """Run func on the single inference thread, holding the request queue slot only while it runs"""
+    global models_initialized  # Add global declaration
+    try:
+        # Wait for queue slot with timeout
+        try:
+            with span('queue_wait'):
+                request_queue.put(True, timeout=30)  # 30 second timeout
+        except queue.Full:
+            logger.error("Request queue is full")
+            raise InferenceUnavailable('Server is busy. Please try again later.', 503)
+        
+        # Initialize models if needed
+        if not models_initialized:
+            with model_lock:
+                if not models_initialized:
+                    logger.info("Initializing models...")
+                    with span('model_init'):
+                        initialized = initialize_models_at_startup()
+                    if not initialized:
+                        raise InferenceUnavailable('Service is initializing, please try again in a few seconds', 503)
+                    models_initialized = True
+                    logger.info("Models initialized successfully")
+        
+        # Process request in thread pool with request context
+        with app.app_context():
+            # Run in a copy of this context so the request and any active profile reach the worker thread
+            context = contextvars.copy_context()
+            profile = request_profiler.active_profile()
+            task = func if profile is None else profile.wrap(func)
+            future = executor.submit(context.run, task, *args, **kwargs)
+            try:
+                return future.result(timeout=30)  # 30 second timeout
+            except concurrent.futures.TimeoutError:
+                logger.error("Request processing timed out")
+                raise InferenceUnavailable('Request processing timed out', 504)
+    finally:
+        try:
+            request_queue.get_nowait()  # Release queue slot
+        except queue.Empty:
+            pass
+        manage_memory()
+        gc.collect()
+
+def profile_request(func):
+    """Decorator that profiles the request when it asks for it (see request_profiler)"""
+    def wrapped(*args, **kwargs):
+        profile = request_profiler.begin(request, has_valid_admin_key)
+        if profile is None:
+            return func(*args, **kwargs)
+        try:
+            result = func(*args, **kwargs)
+        finally:
+            profile.stop()
+        profile.save(profile_dir)
+        response = app.make_response(result)
+        response.headers['X-Profile-Id'] = profile.id
+        response.headers['X-Profile-Url'] = f'/debug/profile/{profile.id}'
+        return response
+    wrapped.__name__ = func.__name__  # Preserve the original function name
+    return wrapped
+
 def process_request(func):
     """Decorator to handle request queuing and memory management"""
     def wrapped(*args, **kwargs):
-        global models_initialized  # Add global declaration
         try:
-            # Wait for queue slot with timeout
-            try:
-                request_queue.put(True, timeout=30)  # 30 second timeout
-            except queue.Full:
-                logger.error("Request queue is full")
-                return jsonify({
-                    'success': False,
-                    'message': 'Server is busy. Please try again later.'
-                }), 503
-            
-            # Initialize models if needed
-            if not models_initialized:
-                with model_lock:
-                    if not models_initialized:
-                        logger.info("Initializing models...")
-                        if not initialize_models_at_startup():
-                            return jsonify({
-                                'success': False,
-                                'message': 'Service is initializing, please try again in a few seconds'
-                            }), 503
-                        models_initialized = True
-                        logger.info("Models initialized successfully")
-            
-            # Process request in thread pool with request context
-            with app.app_context():
-                future = executor.submit(func, *args, **kwargs)
-                try:
-                    result = future.result(timeout=30)  # 30 second timeout
-                    return result
-                except concurrent.futures.TimeoutError:
-                    logger.error("Request processing timed out")
-                    return jsonify({
-                        'success': False,
-                        'message': 'Request processing timed out'
-                    }), 504
-                
+            return run_inference(func, *args, **kwargs)
+        except InferenceUnavailable as e:
+            return jsonify({
+                'success': False,
+                'message': str(e)
+            }), e.status
         except Exception as e:
             logger.error(f"Request processing error: {str(e)}")
             logger.error(traceback.format_exc())
@@ -221,21 +453,8 @@ def process_request(func):
                 'success': False,
                 'message': str(e)
             }), 500
-        finally:
-            try:
-                request_queue.get_nowait()  # Release queue slot
-            except queue.Empty:
-                pass
-            manage_memory()
-            # Clear any large variables
-            for var in list(locals().keys()):
-                if var.startswith('_') or var in ['self', 'args', 'kwargs']:
-                    continue
-                if isinstance(locals()[var], (np.ndarray, tf.Tensor)):
-                    del locals()[var]
-            gc.collect()
     wrapped.__name__ = func.__name__  # Preserve the original function name
-    return wrapped
+    return profile_request(wrapped)
 
 @app.route('/', methods=['GET'])
 def root_health_check():
@@ -281,6 +500,9 @@ def health_check():
             'status': 'healthy',
             'memory': memory_status,
             'models_initialized': models_initialized,
+            'model_startup': model_startup,
+            'registered_faces': len(embedding_store),
+            'audit_log': audit_log.stats(),
             'timestamp': datetime.now().isoformat()
         }), 200
     except Exception as e:
@@ -292,6 +514,7 @@ def health_check():
         }), 500
 
 @app.route('/verify', methods=['POST'])
+@prefetch_images('image1', 'image2')
 @process_request
 def verify_face():
     try:
@@ -319,40 +542,40 @@ def verify_face():
             }), 400
 
         try:
-            image1_data = data['image1'].split(',')[1] if ',' in data['image1'] else data['image1']
-            nparr1 = np.frombuffer(base64.b64decode(image1_data), np.uint8)
-            img1 = cv2.imdecode(nparr1, cv2.IMREAD_COLOR)
-            
-            del image1_data, nparr1
-            gc.collect()
+            # Decoded, RGB and resized to the Facenet input by the preprocess pool
+            rgb_img1 = preprocess_pool.get_image(data, 'image1')
+            rgb_img2 = preprocess_pool.get_image(data, 'image2')
             
-            image2_data = data['image2'].split(',')[1] if ',' in data['image2'] else data['image2']
-            nparr2 = np.frombuffer(base64.b64decode(image2_data), np.uint8)
-            img2 = cv2.imdecode(nparr2, cv2.IMREAD_COLOR)
-            
-            del image2_data, nparr2
-            gc.collect()
-            
-            if img1 is None or img2 is None:
+            if rgb_img1 is None or rgb_img2 is None:
                 return jsonify({
                     'success': False,
                     'message': 'Failed to decode images'
                 }), 400
-                
-            rgb_img1 = cv2.cvtColor(img1, cv2.COLOR_BGR2RGB)
-            rgb_img2 = cv2.cvtColor(img2, cv2.COLOR_BGR2RGB)
             
-            del img1, img2
-            gc.collect()
+            if CASCADE_MODEL:
+                decision = cascade_decision(rgb_img1, rgb_img2)
+                if decision is not None:
+                    audit_decision(data.get('voterId'), decision['distance'], decision['threshold'],
+                                   decision['matchPercentage'], decision['isMatch'], model=CASCADE_MODEL)
+                    return jsonify(decision)
             
-            result = DeepFace.verify(
-                rgb_img1, 
-                rgb_img2, 
-                model_name='Facenet',
-                detector_backend='skip',
-                enforce_detection=False,
-                distance_metric='cosine'
-            )
+            if facenet_graph is not None:
+                with span('inference', call='serving_graph'):
+                    embeddings = facenet_graph(np.stack([facenet_tensor(rgb_img1), facenet_tensor(rgb_img2)]))
+                result = {
+                    'distance': cosine_distances(embeddings[:1], embeddings[1])[0],
+                    'threshold': dst.findThreshold('Facenet', 'cosine')
+                }
+            else:
+                with span('inference', call='DeepFace.verify'):
+                    result = DeepFace.verify(
+                        rgb_img1, 
+                        rgb_img2, 
+                        model_name='Facenet',
+                        detector_backend='skip',
+                        enforce_detection=False,
+                        distance_metric='cosine'
+                    )
             
             del rgb_img1, rgb_img2
             gc.collect()
@@ -364,13 +587,18 @@ def verify_face():
             del result
             gc.collect()
             
+            audit_decision(data.get('voterId'), distance, threshold, match_percentage,
+                           match_percentage >= MATCH_PERCENTAGE_CUTOFF, model='Facenet')
+            
             return jsonify({
                 'success': True,
-                'verified': True if match_percentage >= 70 else False,
+                'verified': True if match_percentage >= MATCH_PERCENTAGE_CUTOFF else False,
                 'distance': distance,
                 'threshold': threshold,
                 'matchPercentage': match_percentage,
-                'isMatch': True if match_percentage >= 70 else False
+                'isMatch': True if match_percentage >= MATCH_PERCENTAGE_CUTOFF else False,
+                'model': 'Facenet',
+                'escalated': bool(CASCADE_MODEL)
             })
         except Exception as e:
             logger.error(f"Image processing error: {str(e)}")
@@ -401,7 +629,38 @@ def verify_face():
         tf.keras.backend.clear_session()
         gc.collect()
 
+def cascade_decision(rgb_img1, rgb_img2):
+    """Decide with the cheap cascade model when its distance is outside the uncertain band, else None"""
+    with span('inference', call='DeepFace.verify', model=CASCADE_MODEL):
+        result = DeepFace.verify(
+            rgb_img1,
+            rgb_img2,
+            model_name=CASCADE_MODEL,
+            detector_backend='skip',
+            enforce_detection=False,
+            distance_metric='cosine'
+        )
+    distance = float(result['distance'])
+    if CASCADE_ACCEPT_BELOW < distance < CASCADE_REJECT_ABOVE:
+        return None
+
+    # Scale so the calibrated match distance lands exactly on the 70% cutoff
+    threshold = CASCADE_MATCH_DISTANCE / (1 - MATCH_PERCENTAGE_CUTOFF / 100)
+    match_percentage = max(0, min(100, (1 - (distance / threshold)) * 100))
+    is_match = distance <= CASCADE_ACCEPT_BELOW
+    return {
+        'success': True,
+        'verified': is_match,
+        'distance': distance,
+        'threshold': threshold,
+        'matchPercentage': match_percentage,
+        'isMatch': is_match,
+        'model': CASCADE_MODEL,
+        'escalated': False
+    }
+
 @app.route('/api/register', methods=['POST', 'OPTIONS'])
+@prefetch_images('faceImage')
 @process_request
 def register_face():
     try:
@@ -430,33 +689,17 @@ def register_face():
             }), 400
 
         try:
-            image_data = data['faceImage'].split(',')[1] if ',' in data['faceImage'] else data['faceImage']
-            nparr = np.frombuffer(base64.b64decode(image_data), np.uint8)
-            img = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
-            
-            del image_data, nparr
-            gc.collect()
+            rgb_img = preprocess_pool.get_image(data, 'faceImage')
             
-            if img is None:
+            if rgb_img is None:
                 return jsonify({
                     'success': False,
                     'message': 'Failed to decode image'
                 }), 400
-                
-            rgb_img = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
-            
-            del img
-            gc.collect()
             
             try:
-                DeepFace.verify(
-                    rgb_img, 
-                    rgb_img, 
-                    model_name='Facenet',
-                    detector_backend='skip',
-                    enforce_detection=False,
-                    distance_metric='cosine'
-                )
+                with span('inference'):
+                    embedding = represent_face(rgb_img)
             except Exception as e:
                 if "No face detected" in str(e):
                     return jsonify({
@@ -468,11 +711,9 @@ def register_face():
             del rgb_img
             gc.collect()
             
-            user_id = data['userId']
-            face_image_path = os.path.join(temp_dir, f'{user_id}_face.txt')
-            
-            with open(face_image_path, 'w') as f:
-                f.write(data['faceImage'])
+            # Re-registration is a single append to the embedding store log
+            user_id = str(data['userId'])
+            embedding_store.put(user_id, embedding)
             
             return jsonify({
                 'success': True,
@@ -498,10 +739,36 @@ def register_face():
         tf.keras.backend.clear_session()
         gc.collect()
 
+@app.route('/api/register/<user_id>', methods=['DELETE'])
+def delete_face(user_id):
+    if not has_valid_admin_key():
+        return jsonify({
+            'success': False,
+            'message': 'Unauthorized'
+        }), 401
+
+    ticket_store.revoke_voter(user_id)
+    if not embedding_store.delete(user_id):
+        return jsonify({
+            'success': False,
+            'message': 'No registered face for this user'
+        }), 404
+
+    return jsonify({
+        'success': True,
+        'message': 'Face registration deleted',
+        'userId': user_id
+    })
+
 @app.route('/verify-voting', methods=['POST'])
 def verify_voting():
     try:
         data = request.get_json()
+        if data and 'voterId' in data:
+            ticketed = ticket_response(data)
+            if ticketed is not None:
+                return ticketed
+
         if not data or 'image' not in data or 'voterId' not in data:
             return jsonify({
                 'success': False,
@@ -509,10 +776,11 @@ def verify_voting():
             }), 400
 
         try:
-            response = requests.get(
-                f"{BACKEND_URL}/api/users/{data['voterId']}",
-                headers={'Authorization': f'Bearer {BACKEND_API_KEY}'}
-            )
+            with span('backend_fetch', resource='voter'):
+                response = requests.get(
+                    f"{BACKEND_URL}/api/users/{data['voterId']}",
+                    headers=tracing.outgoing_headers({'Authorization': f'Bearer {BACKEND_API_KEY}'})
+                )
             if response.status_code != 200:
                 return jsonify({
                     'success': False,
@@ -528,7 +796,8 @@ def verify_voting():
                     'error': 'Registered face image not found'
                 }), 400
 
-            registered_face_response = requests.get(registered_face_url)
+            with span('backend_fetch', resource='registered_face'):
+                registered_face_response = requests.get(registered_face_url)
             if registered_face_response.status_code != 200:
                 return jsonify({
                     'success': False,
@@ -538,12 +807,14 @@ def verify_voting():
             with open('temp_registered.jpg', 'wb') as f:
                 f.write(registered_face_response.content)
 
-            current_image = base64_to_image(data['image'])
+            with span('decode'):
+                current_image = base64_to_image(data['image'])
             current_image.save('temp_current.jpg')
 
-            registered_face_encoding = DeepFace.encode(np.array(Image.open('temp_registered.jpg')))[0]
-            current_face_encoding = DeepFace.encode(np.array(current_image))[0]
-            face_distances = DeepFace.face_distance([registered_face_encoding], current_face_encoding)
+            with span('inference'):
+                registered_face_encoding = DeepFace.encode(np.array(Image.open('temp_registered.jpg')))[0]
+                current_face_encoding = DeepFace.encode(np.array(current_image))[0]
+                face_distances = DeepFace.face_distance([registered_face_encoding], current_face_encoding)
             distance = float(face_distances[0])
             
             threshold = 0.6
@@ -551,20 +822,23 @@ def verify_voting():
             match_percentage = min(100, max(0, (similarity - threshold) * 100 / (1 - threshold)))
             
             if similarity > threshold:
+                image_url = None
+                verified = False  # the outcome the client gets, not just the match
                 try:
                     _, buffer = cv2.imencode('.jpg', np.array(current_image))
                     img_str = base64.b64encode(buffer).decode('utf-8')
                     data_uri = f'data:image/jpeg;base64,{img_str}'
 
-                    cloudinary_response = requests.post(
-                        f'https://api.cloudinary.com/v1_1/{os.environ.get("CLOUDINARY_CLOUD_NAME")}/image/upload',
-                        files={'file': data_uri},
-                        data={
-                            'api_key': os.environ.get('CLOUDINARY_API_KEY'),
-                            'timestamp': int(datetime.now().timestamp()),
-                            'folder': 'face-verification'
-                        }
-                    )
+                    with span('upload'):
+                        cloudinary_response = requests.post(
+                            f'https://api.cloudinary.com/v1_1/{os.environ.get("CLOUDINARY_CLOUD_NAME")}/image/upload',
+                            files={'file': data_uri},
+                            data={
+                                'api_key': os.environ.get('CLOUDINARY_API_KEY'),
+                                'timestamp': int(datetime.now().timestamp()),
+                                'folder': 'face-verification'
+                            }
+                        )
 
                     if cloudinary_response.status_code != 200:
                         return jsonify({
@@ -573,21 +847,29 @@ def verify_voting():
                         }), 500
 
                     cloudinary_data = cloudinary_response.json()
+                    image_url = cloudinary_data['secure_url']
                     
-                    return jsonify({
+                    decision = {
                         'success': True,
                         'message': 'Face identified successfully',
                         'matchPercentage': match_percentage,
                         'voter': voter_data,
-                        'imageUrl': cloudinary_data['secure_url'],
+                        'imageUrl': image_url,
                         'pythonService': 'primary'
-                    })
+                    }
+                    response = jsonify({**decision, **issue_ticket(data, decision)})
+                    verified = True
+                    return response
                 except Exception as e:
                     return jsonify({
                         'success': False,
                         'error': f'Failed to process verification: {str(e)}'
                     }), 500
+                finally:
+                    audit_decision(data['voterId'], distance, threshold, match_percentage, verified,
+                                   image_url=image_url)
             else:
+                audit_decision(data['voterId'], distance, threshold, match_percentage, False)
                 return jsonify({
                     'success': False,
                     'message': 'Face does not match registered face',
@@ -607,6 +889,282 @@ def verify_voting():
             'error': str(e)
         }), 500
 
+@app.route('/verify-ticket', methods=['POST'])
+def verify_ticket():
+    """Check a verification ticket for a voter and device without a new capture"""
+    data = request.get_json(silent=True)
+    if not data or 'voterId' not in data:
+        return jsonify({
+            'success': False,
+            'error': 'Voter ID is required'
+        }), 400
+
+    ticketed = ticket_response(data)
+    if ticketed is None:
+        return jsonify({
+            'success': False,
+            'error': 'Verification ticket is missing, expired or not valid for this voter and device'
+        }), 401
+    return ticketed
+
+@app.route('/api/tickets/<voter_id>', methods=['DELETE'])
+def revoke_tickets(voter_id):
+    """Revoke a voter's tickets, e.g. once their vote has been cast"""
+    if not has_valid_admin_key():
+        return jsonify({
+            'success': False,
+            'message': 'Unauthorized'
+        }), 401
+
+    return jsonify({
+        'success': True,
+        'voterId': voter_id,
+        'revoked': ticket_store.revoke_voter(voter_id)
+    })
+
+@app.route('/debug/profile/<profile_id>', methods=['GET'])
+def download_profile(profile_id):
+    if not has_valid_admin_key():
+        return jsonify({
+            'success': False,
+            'message': 'Unauthorized'
+        }), 401
+
+    profile_path = os.path.join(profile_dir, f'{secure_filename(profile_id)}.json')
+    if not os.path.exists(profile_path):
+        return jsonify({
+            'success': False,
+            'message': 'Profile not found'
+        }), 404
+
+    return send_file(profile_path, mimetype='application/json', as_attachment=True,
+                     download_name=f'profile-{secure_filename(profile_id)}.json')
+
+def bulk_job_path(job_id):
+    return os.path.join(bulk_jobs_dir, f'job-{secure_filename(job_id)}.json')
+
+def save_bulk_job(job):
+    path = bulk_job_path(job['jobId'])
+    tmp_path = f'{path}.tmp-{os.getpid()}'
+    with open(tmp_path, 'w') as f:
+        json.dump(job, f)
+    os.replace(tmp_path, path)
+
+def load_bulk_job(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def process_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+def positive_int(value):
+    """value as an int when it is a positive integer or its decimal string, else None"""
+    if isinstance(value, bool) or not isinstance(value, (int, str)):
+        return None
+    try:
+        number = int(value)
+    except ValueError:
+        return None
+    return number if number > 0 else None
+
+def run_bulk_enrollment(job):
+    """Run a job whose bulk_lock the caller holds, releasing it when done"""
+    try:
+        if facenet_graph is not None:
+            embed = facenet_graph
+        else:
+            model = DeepFace.build_model("Facenet")
+            embed = lambda batch: model.predict(batch, verbose=0)
+        job['report'] = bulk_enroll.run(
+            job['source'],
+            embedding_store,
+            embed=embed,
+            batch_size=job['batchSize'],
+            workers=job['workers'],
+            checkpoint_path=job['checkpoint']
+        )
+        job['status'] = 'completed'
+    except Exception as e:
+        logger.error(f"Bulk enrolment error: {str(e)}")
+        logger.error(traceback.format_exc())
+        job['status'] = 'failed'
+        job['error'] = str(e)
+    finally:
+        job['finishedAt'] = datetime.now().isoformat()
+        try:
+            save_bulk_job(job)
+        except OSError as e:
+            logger.error(f"Failed to save bulk enrolment job {job['jobId']}: {str(e)}")
+        bulk_lock.release()
+        gc.collect()
+
+def start_bulk_thread(job):
+    job['pid'] = os.getpid()
+    save_bulk_job(job)
+    threading.Thread(target=run_bulk_enrollment, args=(job,), daemon=True).start()
+
+@app.before_request
+def resume_bulk_enrollment():
+    # A recycled worker takes its job thread with it; the next worker picks the job up from its checkpoint
+    global bulk_resume_checked
+    if bulk_resume_checked:
+        return
+    bulk_resume_checked = True
+    for path in glob.glob(os.path.join(bulk_jobs_dir, 'job-*.json')):
+        job = load_bulk_job(path)
+        if job is None or job['status'] != 'running':
+            continue
+        # This process has started no job yet, so its own PID in a record is a reused one
+        if job['pid'] != os.getpid() and process_alive(job['pid']):
+            continue
+        if not bulk_lock.acquire(blocking=False):
+            return
+        logger.info(f"Resuming bulk enrolment {job['jobId']} interrupted in worker {job['pid']}")
+        job['resumedAt'] = datetime.now().isoformat()
+        try:
+            start_bulk_thread(job)
+        except Exception:
+            bulk_lock.release()
+            raise
+        return
+
+@app.route('/api/bulk-enroll', methods=['POST'])
+def start_bulk_enrollment():
+    if not has_valid_admin_key():
+        return jsonify({
+            'success': False,
+            'message': 'Unauthorized'
+        }), 401
+
+    data = request.get_json(silent=True) or {}
+    source = data.get('source')
+    if not source or not os.path.exists(source):
+        return jsonify({
+            'success': False,
+            'message': 'source must be an NDJSON file or image directory on the server'
+        }), 400
+
+    batch_size = positive_int(data.get('batchSize', 256))
+    workers = positive_int(data['workers']) if data.get('workers') is not None else None
+    if batch_size is None or (data.get('workers') is not None and workers is None):
+        return jsonify({
+            'success': False,
+            'message': 'batchSize and workers must be positive integers'
+        }), 400
+
+    # Taken here rather than in the job thread, so two requests cannot both start a job
+    if not bulk_lock.acquire(blocking=False):
+        return jsonify({
+            'success': False,
+            'message': 'A bulk enrolment is already running'
+        }), 409
+
+    job_id = uuid.uuid4().hex
+    job = {
+        'jobId': job_id,
+        'source': source,
+        'batchSize': batch_size,
+        'workers': workers,
+        'checkpoint': os.path.join(bulk_jobs_dir, f'{job_id}.checkpoint.json'),
+        'status': 'running',
+        'startedAt': datetime.now().isoformat()
+    }
+    try:
+        start_bulk_thread(job)
+    except Exception:
+        bulk_lock.release()
+        raise
+
+    return jsonify({
+        'success': True,
+        'jobId': job_id,
+        'statusUrl': f'/api/bulk-enroll/{job_id}'
+    }), 202
+
+@app.route('/api/bulk-enroll/<job_id>', methods=['GET'])
+def bulk_enrollment_status(job_id):
+    if not has_valid_admin_key():
+        return jsonify({
+            'success': False,
+            'message': 'Unauthorized'
+        }), 401
+
+    job = load_bulk_job(bulk_job_path(job_id))
+    if job is None:
+        return jsonify({
+            'success': False,
+            'message': 'Job not found'
+        }), 404
+
+    if job['status'] == 'running':
+        checkpoint = bulk_enroll.Checkpoint(job['checkpoint'], job['source'])
+        job['progress'] = {
+            'processed': checkpoint.processed,
+            'enrolled': checkpoint.enrolled,
+            'failed': checkpoint.failed
+        }
+    return jsonify({'success': True, **job})
+
+@app.route('/debug/traces', methods=['GET'])
+def recent_traces():
+    if not has_valid_admin_key():
+        return jsonify({
+            'success': False,
+            'message': 'Unauthorized'
+        }), 401
+
+    limit = request.args.get('limit', 50, type=int)
+    if limit is None:
+        return jsonify({
+            'success': False,
+            'message': 'limit must be an integer'
+        }), 400
+
+    limit = max(1, min(limit, tracing.TRACE_BUFFER_SIZE))
+    return jsonify({
+        'success': True,
+        'traces': tracing.exporter.recent(request.args.get('traceId'), limit)
+    })
+
+@app.route('/debug/allocations', methods=['GET'])
+def allocation_report():
+    if not has_valid_admin_key():
+        return jsonify({
+            'success': False,
+            'message': 'Unauthorized'
+        }), 401
+
+    return jsonify({'success': True, **allocation_tracker.report()})
+
+@app.route('/debug/allocations/<action>', methods=['POST'])
+def control_allocation_tracking(action):
+    if not has_valid_admin_key():
+        return jsonify({
+            'success': False,
+            'message': 'Unauthorized'
+        }), 401
+
+    if action not in ('start', 'stop', 'reset'):
+        return jsonify({
+            'success': False,
+            'message': 'Action must be start, stop or reset'
+        }), 400
+
+    getattr(allocation_tracker, action)()
+    return jsonify({
+        'success': True,
+        'enabled': allocation_tracker.enabled
+    })
+
 def download_image_from_url(url):
     try:
         print(f"Downloading image from URL: {url}")
@@ -629,6 +1187,8 @@ def base64_to_image(base64_string):
         
         image_data = base64.b64decode(base64_string)
         image = Image.open(BytesIO(image_data))
+        # Let JPEG decoding skip resolution beyond the capture spec
+        image.draft('RGB', (capture_spec.FACE_SPEC['maxWidth'], capture_spec.FACE_SPEC['maxHeight']))
         
         if image.mode == 'RGBA':
             image = image.convert('RGB')
@@ -639,6 +1199,11 @@ def base64_to_image(base64_string):
         print(f"Error converting base64 to image: {str(e)}")
         raise Exception(f"Error converting base64 to image: {str(e)}")
 
+# Face quality thresholds
+BRIGHTNESS_THRESHOLD = 40
+CONTRAST_THRESHOLD = 20
+SHARPNESS_THRESHOLD = 100
+
 def check_face_quality(image):
     image_np = np.array(image)
     
@@ -652,10 +1217,6 @@ def check_face_quality(image):
     laplacian = cv2.Laplacian(gray, cv2.CV_64F)
     sharpness = np.var(laplacian)
     
-    BRIGHTNESS_THRESHOLD = 40
-    CONTRAST_THRESHOLD = 20
-    SHARPNESS_THRESHOLD = 100
-    
     if brightness < BRIGHTNESS_THRESHOLD:
         return False, "Image is too dark"
     if contrast < CONTRAST_THRESHOLD:
@@ -665,6 +1226,320 @@ def check_face_quality(image):
     
     return True, "Image quality is good"
 
+# Burst capture settings
+BURST_MAX_FRAMES = int(os.environ.get('BURST_MAX_FRAMES', 8))
+BURST_EMBED_FRAMES = int(os.environ.get('BURST_EMBED_FRAMES', 2))
+BURST_QUALITY_SIZE = 128  # Frames are scored on a 128x128 grayscale thumbnail
+BURST_FACE_MARGIN = 0.2  # Face crops keep this fraction of the box size around it
+face_cascade = cv2.CascadeClassifier(os.path.join(cv2.data.haarcascades, 'haarcascade_frontalface_default.xml'))
+
+# Preferred upload size per route, advertised at /capture-spec
+CAPTURE_SPECS = capture_spec.build_specs(BURST_MAX_FRAMES)
+
+@app.route('/capture-spec', methods=['GET'])
+def get_capture_spec():
+    route = request.args.get('route')
+    if route:
+        spec = CAPTURE_SPECS.get(route)
+        if spec is None:
+            return jsonify({
+                'success': False,
+                'message': f'No capture spec for {route}'
+            }), 404
+        return jsonify({'success': True, 'route': route, 'spec': spec})
+
+    response = jsonify({
+        'success': True,
+        'enforce': capture_spec.CAPTURE_SPEC_ENFORCE,
+        'routes': CAPTURE_SPECS
+    })
+    response.headers['Cache-Control'] = 'public, max-age=3600'
+    return response
+
+def decode_base64_image(image_string):
+    """Decode a base64 (optionally data URI) string into an RGB array no larger than the capture spec needs, or None"""
+    if not isinstance(image_string, str):
+        return None
+    image_data = image_string.split(',')[1] if ',' in image_string else image_string
+    try:
+        raw = base64.b64decode(image_data, validate=True)
+    except (binascii.Error, ValueError):
+        return None
+    img = capture_spec.decode_image_bytes(raw, capture_spec.FACE_SPEC['maxWidth'])
+    if img is None:
+        return None
+    return cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
+
+def largest_face(gray):
+    """(x, y, w, h) of the largest Haar cascade face in a grayscale image, or None"""
+    faces = face_cascade.detectMultiScale(gray, scaleFactor=1.1, minNeighbors=4, minSize=(24, 24))
+    if not len(faces):
+        return None
+    return tuple(int(v) for v in max(faces, key=lambda face: face[2] * face[3]))
+
+def crop_face(rgb_image, box, margin=BURST_FACE_MARGIN):
+    """Crop an RGB image to a face box grown by margin on each side; the whole image without a box"""
+    if box is None:
+        return rgb_image
+    x, y, w, h = box
+    dx, dy = int(w * margin), int(h * margin)
+    height, width = rgb_image.shape[:2]
+    return rgb_image[max(0, y - dy):min(height, y + h + dy), max(0, x - dx):min(width, x + w + dx)]
+
+def detect_face(rgb_image):
+    """Largest face box in an RGB image, found on a thumbnail and scaled back to image coordinates"""
+    height, width = rgb_image.shape[:2]
+    scale = min(1.0, BURST_QUALITY_SIZE * 2 / max(height, width))
+    gray = cv2.cvtColor(rgb_image, cv2.COLOR_RGB2GRAY)
+    if scale < 1.0:
+        gray = cv2.resize(gray, (int(width * scale), int(height * scale)), interpolation=cv2.INTER_AREA)
+    box = largest_face(gray)
+    if box is None:
+        return None
+    return tuple(int(round(v / scale)) for v in box)
+
+def score_frames(frames):
+    """Score RGB frames on brightness, contrast, sharpness and face size in one vectorized pass.
+
+    Returns the scores, the largest face box in each frame (or None) and the per-frame metrics.
+    """
+    gray = np.stack([
+        cv2.resize(cv2.cvtColor(frame, cv2.COLOR_RGB2GRAY), (BURST_QUALITY_SIZE, BURST_QUALITY_SIZE),
+                   interpolation=cv2.INTER_AREA)
+        for frame in frames
+    ])
+
+    stack = gray.astype(np.float32)
+    brightness = stack.mean(axis=(1, 2))
+    contrast = stack.std(axis=(1, 2))
+    # 4-neighbour Laplacian over the whole stack
+    laplacian = (stack[:, :-2, 1:-1] + stack[:, 2:, 1:-1] + stack[:, 1:-1, :-2] + stack[:, 1:-1, 2:]
+                 - 4 * stack[:, 1:-1, 1:-1])
+    sharpness = laplacian.var(axis=(1, 2))
+
+    face_fraction = np.zeros(len(frames), dtype=np.float32)
+    boxes = []
+    for i, (frame, thumb) in enumerate(zip(frames, gray)):
+        box = largest_face(thumb)
+        if box is None:
+            boxes.append(None)
+            continue
+        x, y, w, h = box
+        face_fraction[i] = w * h / float(BURST_QUALITY_SIZE ** 2)
+        # Thumbnails are square, so scale each axis back separately
+        sx, sy = frame.shape[1] / BURST_QUALITY_SIZE, frame.shape[0] / BURST_QUALITY_SIZE
+        boxes.append((int(x * sx), int(y * sy), int(w * sx), int(h * sy)))
+
+    quality_ok = (brightness >= BRIGHTNESS_THRESHOLD) & (contrast >= CONTRAST_THRESHOLD)
+    sharpness_norm = sharpness / max(float(sharpness.max()), 1e-6)
+    face_norm = face_fraction / max(float(face_fraction.max()), 1e-6)
+    scores = (0.5 * sharpness_norm + 0.5 * face_norm) * np.where(quality_ok, 1.0, 0.1)
+
+    return scores, boxes, {
+        'brightness': brightness.tolist(),
+        'contrast': contrast.tolist(),
+        'sharpness': sharpness.tolist(),
+        'faceFraction': face_fraction.tolist()
+    }
+
+def facenet_tensor(rgb_image):
+    """Float32 Facenet input for an RGB face crop, prepared as DeepFace does for detector_backend='skip'"""
+    return preprocessing.resize_and_pad(rgb_image).astype(np.float32) / 255.0
+
+def represent_face(rgb_image):
+    """Facenet embedding for an RGB image that is already a face crop"""
+    if facenet_graph is not None:
+        return facenet_graph(facenet_tensor(rgb_image)[np.newaxis])[0].astype(np.float32)
+    embedding = DeepFace.represent(
+        rgb_image,
+        model_name='Facenet',
+        detector_backend='skip',
+        enforce_detection=False
+    )[0]['embedding']
+    return np.asarray(embedding, dtype=np.float32)
+
+def cosine_distances(embeddings, reference):
+    """Cosine distance from each row of embeddings to reference"""
+    embeddings = embeddings / np.linalg.norm(embeddings, axis=1, keepdims=True)
+    reference = reference / np.linalg.norm(reference)
+    return 1 - embeddings @ reference
+
+def embed_burst(reference_face, faces):
+    """Facenet embeddings of the registered face and the chosen frame crops; runs in the inference slot"""
+    with span('inference'):
+        reference = represent_face(reference_face)
+        embeddings = np.stack([represent_face(face) for face in faces])
+    return reference, embeddings
+
+@app.route('/verify-voting-burst', methods=['POST'])
+@profile_request
+def verify_voting_burst():
+    """Verify a voter from a short burst of frames, embedding only the best ones.
+
+    Only embedding waits for the inference slot; decoding, backend fetches
+    and the upload run on the request thread.
+    """
+    try:
+        data = request.get_json(silent=True)
+        if data and 'voterId' in data:
+            ticketed = ticket_response(data)
+            if ticketed is not None:
+                return ticketed
+
+        if not data or 'frames' not in data or 'voterId' not in data:
+            return jsonify({
+                'success': False,
+                'error': 'Frames and voter ID are required'
+            }), 400
+
+        if not isinstance(data['frames'], list) or not 1 <= len(data['frames']) <= BURST_MAX_FRAMES:
+            return jsonify({
+                'success': False,
+                'error': f'Between 1 and {BURST_MAX_FRAMES} frames are required'
+            }), 400
+
+        with span('decode'):
+            decoded = [decode_base64_image(frame) for frame in data['frames']]
+        # Indices into the client's frames array of the frames that decoded
+        indices = [i for i, frame in enumerate(decoded) if frame is not None]
+        frames = [decoded[i] for i in indices]
+        if not frames:
+            return jsonify({
+                'success': False,
+                'error': 'Failed to decode frames'
+            }), 400
+
+        with span('quality_check'):
+            scores, boxes, metrics = score_frames(frames)
+        best = np.argsort(-scores)[:BURST_EMBED_FRAMES]
+
+        with span('backend_fetch', resource='voter'):
+            response = requests.get(
+                f"{BACKEND_URL}/api/users/{data['voterId']}",
+                headers=tracing.outgoing_headers({'Authorization': f'Bearer {BACKEND_API_KEY}'}),
+                timeout=10
+            )
+        if response.status_code != 200:
+            return jsonify({
+                'success': False,
+                'error': 'Failed to fetch voter data'
+            }), 400
+
+        voter_data = response.json()
+        registered_face_url = voter_data.get('faceImageUrl')
+        if not registered_face_url:
+            return jsonify({
+                'success': False,
+                'error': 'Registered face image not found'
+            }), 400
+
+        with span('backend_fetch', resource='registered_face'):
+            registered_face_response = requests.get(registered_face_url, timeout=10)
+        if registered_face_response.status_code != 200:
+            return jsonify({
+                'success': False,
+                'error': 'Failed to fetch registered face image'
+            }), 400
+
+        registered_img = cv2.imdecode(np.frombuffer(registered_face_response.content, np.uint8), cv2.IMREAD_COLOR)
+        if registered_img is None:
+            return jsonify({
+                'success': False,
+                'error': 'Failed to decode registered face image'
+            }), 400
+        registered_rgb = cv2.cvtColor(registered_img, cv2.COLOR_BGR2RGB)
+
+        # Embed face crops on both sides, so the comparison is like for like
+        reference_face = crop_face(registered_rgb, detect_face(registered_rgb))
+        faces = [crop_face(frames[i], boxes[i]) for i in best]
+        try:
+            reference, embeddings = run_inference(embed_burst, reference_face, faces)
+        except InferenceUnavailable as e:
+            return jsonify({
+                'success': False,
+                'error': str(e)
+            }), e.status
+        distances = cosine_distances(embeddings, reference)
+
+        chosen = int(np.argmin(distances))
+        best_frame = int(best[chosen])
+        distance = float(distances[chosen])
+
+        # Same decision rule as /verify-voting
+        threshold = 0.6
+        similarity = 1 - distance
+        match_percentage = min(100, max(0, (similarity - threshold) * 100 / (1 - threshold)))
+
+        def by_frame(values):
+            """Per-frame values laid out like the client's frames array, None for frames that did not decode"""
+            laid_out = [None] * len(data['frames'])
+            for i, value in zip(indices, values):
+                laid_out[i] = value
+            return laid_out
+
+        result = {
+            'matchPercentage': match_percentage,
+            'distance': distance,
+            'frameIndex': indices[best_frame],
+            'framesReceived': len(data['frames']),
+            'framesDecoded': len(frames),
+            'framesEmbedded': len(best),
+            'faceDetected': boxes[best_frame] is not None,
+            'frameScores': by_frame(scores.tolist()),
+            'frameMetrics': {name: by_frame(values) for name, values in metrics.items()}
+        }
+
+        if similarity <= threshold:
+            audit_decision(data['voterId'], distance, threshold, match_percentage, False, model='Facenet')
+            return jsonify({
+                'success': False,
+                'message': 'Face does not match registered face',
+                'error': 'Face verification failed',
+                **result
+            }), 401
+
+        _, buffer = cv2.imencode('.jpg', cv2.cvtColor(frames[best_frame], cv2.COLOR_RGB2BGR))
+        img_str = base64.b64encode(buffer).decode('utf-8')
+        with span('upload'):
+            cloudinary_response = requests.post(
+                f'https://api.cloudinary.com/v1_1/{os.environ.get("CLOUDINARY_CLOUD_NAME")}/image/upload',
+                files={'file': f'data:image/jpeg;base64,{img_str}'},
+                data={
+                    'api_key': os.environ.get('CLOUDINARY_API_KEY'),
+                    'timestamp': int(datetime.now().timestamp()),
+                    'folder': 'face-verification'
+                },
+                timeout=30
+            )
+        if cloudinary_response.status_code != 200:
+            audit_decision(data['voterId'], distance, threshold, match_percentage, False, model='Facenet')
+            return jsonify({
+                'success': False,
+                'error': 'Failed to upload verification image'
+            }), 500
+
+        image_url = cloudinary_response.json()['secure_url']
+        audit_decision(data['voterId'], distance, threshold, match_percentage, True, model='Facenet',
+                       image_url=image_url)
+        decision = {
+            'success': True,
+            'message': 'Face identified successfully',
+            'voter': voter_data,
+            'imageUrl': image_url,
+            'pythonService': 'primary',
+            'matchPercentage': match_percentage
+        }
+        return jsonify({**decision, **result, **issue_ticket(data, decision)})
+
+    except Exception as e:
+        logger.error(f"Burst verification error: {str(e)}")
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
+    finally:
+        gc.collect()
+
 # Only run the Flask development server if this script is run directly
 if __name__ == '__main__':
     try:
@@ -710,8 +1585,9 @@ if __name__ == '__main__':
 def add_cors_headers(response):
     """Add CORS headers to the response"""
     response.headers['Access-Control-Allow-Origin'] = '*'
-    response.headers['Access-Control-Allow-Methods'] = 'GET, POST, OPTIONS'
-    response.headers['Access-Control-Allow-Headers'] = 'Content-Type, Authorization, Accept'
+    response.headers['Access-Control-Allow-Methods'] = 'GET, POST, DELETE, OPTIONS'
+    response.headers['Access-Control-Allow-Headers'] = 'Content-Type, Authorization, Accept, X-Request-Id, X-Verification-Ticket, X-Device-Id'
+    response.headers['Access-Control-Expose-Headers'] = 'X-Request-Id'
     response.headers['Access-Control-Max-Age'] = '3600'
     return response
 
@@ -775,18 +1651,33 @@ def upload_photo():
                 })
                 return add_cors_headers(response), 400
 
+            # Oversized photos accepted in downscale mode are stored at the spec's size, not as sent
+            photo_spec = CAPTURE_SPECS[request.path]
+            if len(decoded_data) > photo_spec['maxImageBytes']:
+                with span('downscale'):
+                    downscaled = capture_spec.downscale_to_spec(decoded_data, photo_spec)
+                if downscaled is None:
+                    response = jsonify({
+                        'success': False,
+                        'message': 'Invalid image data format'
+                    })
+                    return add_cors_headers(response), 400
+                logger.info(f"Downscaled photo from {len(decoded_data)} to {len(downscaled)} bytes before upload")
+                image_data = base64.b64encode(downscaled).decode('ascii')
+
             # Upload to Cloudinary
             logger.info("Uploading to Cloudinary...")
-            cloudinary_response = requests.post(
-                f'https://api.cloudinary.com/v1_1/{cloud_name}/image/upload',
-                files={'file': f'data:image/jpeg;base64,{image_data}'},
-                data={
-                    'api_key': api_key,
-                    'timestamp': int(datetime.now().timestamp()),
-                    'folder': 'face-verification'
-                },
-                timeout=30  # 30 second timeout
-            )
+            with span('upload'):
+                cloudinary_response = requests.post(
+                    f'https://api.cloudinary.com/v1_1/{cloud_name}/image/upload',
+                    files={'file': f'data:image/jpeg;base64,{image_data}'},
+                    data={
+                        'api_key': api_key,
+                        'timestamp': int(datetime.now().timestamp()),
+                        'folder': 'face-verification'
+                    },
+                    timeout=30  # 30 second timeout
+                )
 
             if cloudinary_response.status_code != 200:
                 logger.error(f"Cloudinary upload failed: {cloudinary_response.text}")
@@ -19,7 +19,8 @@ timeout = 120  # 2 minutes
 graceful_timeout = 30  # 30 seconds
 
 # Memory management
-max_requests = 5  # Restart workers after 5 requests
+# Restart workers after this many requests; raise it once ALLOC_TRACKING shows no per-request growth
+max_requests = int(os.environ.get('GUNICORN_MAX_REQUESTS', 5))
 max_requests_jitter = 1  # Add some randomness to prevent all workers from restarting at once
 
 # Disable preload to reduce memory usage
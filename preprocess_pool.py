@@ -0,0 +1,224 @@
+"""Decode and preprocessing stage running in a process pool.
+
+Base64 decoding, ``cv2.imdecode``, colour conversion and resizing to the
+Facenet input size run in worker processes, off the GIL of the inference
+thread. Workers write the resulting uint8 tensor into a pre-allocated
+shared-memory slot owned by this process, so only the slot name and the
+shape cross the process boundary. Decoding is started before the request
+waits for the inference queue, so it overlaps with the request currently
+being served.
+
+The inference thread copies the tensor out of its slot and hands the slot
+straight back. A request that times out (504) while its inference is
+queued or running therefore never frees a slot its inference still reads;
+an inference that starts after the request has released its slots
+decodes in-process instead.
+
+Set ``PREPROCESS_WORKERS=0`` to decode in-process instead.
+"""
+import atexit
+import base64
+import contextvars
+import logging
+import multiprocessing
+import os
+import queue
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from functools import wraps
+from multiprocessing import shared_memory
+
+import cv2
+import numpy as np
+
+from capture_spec import decode_image_bytes
+from preprocessing import FACENET_INPUT_SIZE, resize_and_pad
+from tracing import span
+
+logger = logging.getLogger(__name__)
+
+PREPROCESS_WORKERS = int(os.environ.get('PREPROCESS_WORKERS', 1))
+PREPROCESS_SLOTS = int(os.environ.get('PREPROCESS_SLOTS', 8))
+SLOT_SHAPE = FACENET_INPUT_SIZE + (3,)
+SLOT_BYTES = int(np.prod(SLOT_SHAPE))
+SLOT_TIMEOUT = 30  # seconds, matches the request timeout
+
+_prefetched = contextvars.ContextVar('prefetched_images', default=None)
+
+
+def decode_image(image_string):
+    """Decode a base64 (optionally data URI) string into a 160x160 RGB uint8 tensor, or None"""
+    image_data = image_string.split(',')[1] if ',' in image_string else image_string
+    img = decode_image_bytes(base64.b64decode(image_data), FACENET_INPUT_SIZE[0])
+    if img is None:
+        return None
+    return resize_and_pad(cv2.cvtColor(img, cv2.COLOR_BGR2RGB))
+
+
+def _decode_into_slot(image_string, slot_name):
+    """Worker side: decode and write the tensor into the named slot; returns False on decode failure"""
+    face = decode_image(image_string)
+    if face is None:
+        return False
+    shm = shared_memory.SharedMemory(name=slot_name)
+    try:
+        view = np.ndarray(SLOT_SHAPE, dtype=np.uint8, buffer=shm.buf)
+        view[:] = face
+        del view
+    finally:
+        shm.close()
+    return True
+
+
+class PreprocessPool:
+    def __init__(self, workers=PREPROCESS_WORKERS, slots=PREPROCESS_SLOTS):
+        self._workers = workers
+        self._executor_lock = threading.Lock()
+        self._executor = self._new_executor()
+        self._slots = [shared_memory.SharedMemory(create=True, size=SLOT_BYTES) for _ in range(slots)]
+        self._free = queue.Queue()
+        for index in range(slots):
+            self._free.put(index)
+        logger.info(f"Preprocess pool started with {workers} workers and {slots} shared-memory slots")
+
+    def _new_executor(self):
+        # Spawn rather than fork: forking a process that has started TensorFlow threads is unsafe
+        return ProcessPoolExecutor(max_workers=self._workers, mp_context=multiprocessing.get_context('spawn'))
+
+    def _submit(self, image_string, slot_name):
+        executor = self._executor
+        try:
+            return executor.submit(_decode_into_slot, image_string, slot_name)
+        except BrokenProcessPool:
+            # A worker died; every later submit would fail the same way, so start a new pool once
+            with self._executor_lock:
+                if self._executor is executor:
+                    logger.warning("Preprocess pool broken, restarting its workers")
+                    executor.shutdown(wait=False, cancel_futures=True)
+                    self._executor = self._new_executor()
+            return self._executor.submit(_decode_into_slot, image_string, slot_name)
+
+    def submit(self, image_string):
+        """Start decoding image_string; returns a handle for get()/release()"""
+        try:
+            index = self._free.get_nowait()
+        except queue.Empty:
+            # All slots busy: decode in-process when the image is needed
+            return PrefetchedImage(self, None, None, image_string)
+        try:
+            future = self._submit(image_string, self._slots[index].name)
+        except Exception:
+            self._free.put(index)
+            raise
+        return PrefetchedImage(self, index, future, image_string)
+
+    def view(self, index):
+        return np.ndarray(SLOT_SHAPE, dtype=np.uint8, buffer=self._slots[index].buf)
+
+    def release(self, index):
+        self._free.put(index)
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+        for slot in self._slots:
+            try:
+                slot.close()
+            except BufferError:
+                pass  # A view is still alive; the mapping goes away with the process
+            slot.unlink()
+
+
+class PrefetchedImage:
+    def __init__(self, pool, index, future, image_string):
+        self._pool = pool
+        self._index = index
+        self._future = future
+        self._image_string = image_string
+        self._lock = threading.Lock()  # the request thread releases while the inference thread may read
+
+    def get(self):
+        """The decoded RGB tensor, or None if the image could not be decoded"""
+        with self._lock:
+            if self._index is not None:
+                try:
+                    with span('decode_wait'):
+                        decoded = self._future.result(timeout=SLOT_TIMEOUT)
+                except BrokenProcessPool:
+                    # The worker died with this image; its slot holds nothing, decode it here instead
+                    self._pool.release(self._index)
+                    self._index = None
+                else:
+                    face = self._pool.view(self._index).copy() if decoded else None
+                    self._pool.release(self._index)
+                    self._index = None
+                    return face
+        with span('decode'):
+            return decode_image(self._image_string)
+
+    def release(self):
+        with self._lock:
+            if self._index is None:
+                return
+            try:
+                self._future.result(timeout=SLOT_TIMEOUT)  # never hand back a slot a worker is still writing
+            except Exception:
+                pass
+            self._pool.release(self._index)
+            self._index = None
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool():
+    global _pool
+    if PREPROCESS_WORKERS <= 0:
+        return None
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = PreprocessPool()
+                atexit.register(_pool.shutdown)
+    return _pool
+
+
+def prefetch_images(*fields):
+    """Decorator: start decoding the given base64 JSON fields before the request is queued"""
+    def decorator(func):
+        @wraps(func)
+        def wrapped(*args, **kwargs):
+            from flask import request
+            pool = get_pool()
+            data = request.get_json(silent=True) if request.method == 'POST' else None
+            if pool is None or not isinstance(data, dict):
+                return func(*args, **kwargs)
+
+            handles = {}
+            try:
+                for field in fields:
+                    value = data.get(field)
+                    if isinstance(value, str) and value:
+                        handles[field] = pool.submit(value)
+            except Exception as e:
+                logger.warning(f"Preprocess pool unavailable, decoding in-process: {str(e)}")
+
+            token = _prefetched.set(handles)
+            try:
+                return func(*args, **kwargs)
+            finally:
+                _prefetched.reset(token)
+                for handle in handles.values():
+                    handle.release()
+        return wrapped
+    return decorator
+
+
+def get_image(data, field):
+    """Decoded 160x160 RGB tensor for a JSON field, from the pool when it was prefetched"""
+    handles = _prefetched.get()
+    if handles and field in handles:
+        return handles[field].get()
+    with span('decode'):
+        return decode_image(data[field])
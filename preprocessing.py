@@ -0,0 +1,21 @@
+"""Image preprocessing shared by the server, the preprocess pool and the offline tools.
+
+Kept free of TensorFlow and DeepFace imports, so spawned pool workers and
+the evaluation scripts can import it cheaply.
+"""
+import cv2
+import numpy as np
+
+FACENET_INPUT_SIZE = (160, 160)
+
+
+def resize_and_pad(rgb, target_size=FACENET_INPUT_SIZE):
+    """Resize keeping aspect ratio and zero-pad to target_size, as DeepFace does for detector_backend='skip'"""
+    factor = min(target_size[0] / rgb.shape[0], target_size[1] / rgb.shape[1])
+    resized = cv2.resize(rgb, (int(rgb.shape[1] * factor), int(rgb.shape[0] * factor)))
+    diff_0 = target_size[0] - resized.shape[0]
+    diff_1 = target_size[1] - resized.shape[1]
+    padded = np.pad(resized, ((diff_0 // 2, diff_0 - diff_0 // 2), (diff_1 // 2, diff_1 - diff_1 // 2), (0, 0)), 'constant')
+    if padded.shape[0:2] != target_size:
+        padded = cv2.resize(padded, (target_size[1], target_size[0]))
+    return padded
@@ -0,0 +1,43 @@
+// Capture settings advertised by the face verification service (GET /capture-spec).
+// Frames are downscaled and JPEG-encoded to the spec before upload.
+const CaptureSpec = (function() {
+    // Used when the spec cannot be fetched; mirror FACE_SPEC and PHOTO_SPEC in capture_spec.py
+    const FACE_DEFAULT = { maxWidth: 320, maxHeight: 320, format: 'image/jpeg', quality: 0.85 };
+    const PHOTO_DEFAULT = { maxWidth: 640, maxHeight: 640, format: 'image/jpeg', quality: 0.85 };
+
+    async function load(serviceUrl, route) {
+        const cacheKey = `captureSpec:${serviceUrl}`;
+        let routes = null;
+        try {
+            routes = JSON.parse(sessionStorage.getItem(cacheKey));
+        } catch (error) {
+            routes = null;
+        }
+
+        if (!routes) {
+            try {
+                const response = await fetch(`${serviceUrl}/capture-spec`, {
+                    headers: { 'Accept': 'application/json' }
+                });
+                if (response.ok) {
+                    routes = (await response.json()).routes;
+                    sessionStorage.setItem(cacheKey, JSON.stringify(routes));
+                }
+            } catch (error) {
+                console.warn('Could not load capture spec, using defaults:', error.message);
+            }
+        }
+
+        return (routes && routes[route]) || (route === '/api/upload-photo' ? PHOTO_DEFAULT : FACE_DEFAULT);
+    }
+
+    function capture(video, canvas, spec) {
+        const scale = Math.min(1, spec.maxWidth / video.videoWidth, spec.maxHeight / video.videoHeight);
+        canvas.width = Math.round(video.videoWidth * scale);
+        canvas.height = Math.round(video.videoHeight * scale);
+        canvas.getContext('2d').drawImage(video, 0, 0, canvas.width, canvas.height);
+        return canvas.toDataURL(spec.format, spec.quality);
+    }
+
+    return { load, capture };
+})();
@@ -1,3 +1,5 @@
+const FACE_SERVICE_URL = "https://voter-verify-face-ofgu.onrender.com";
+
 document.addEventListener("DOMContentLoaded", () => {
     const video = document.getElementById("video");
     const captureBtn = document.getElementById("captureBtn");
@@ -54,17 +56,12 @@ document.addEventListener("DOMContentLoaded", () => {
                 result.className = "text-info";
             }
             
-            // Capture image from video stream
-            const context = canvas.getContext("2d");
-            canvas.width = video.videoWidth;
-            canvas.height = video.videoHeight;
-            context.drawImage(video, 0, 0, canvas.width, canvas.height);
-            
-            // Convert image to base64
-            const imageData = canvas.toDataURL("image/jpeg");
+            // Capture image from video stream, downscaled to the face capture spec (needs js/capture-spec.js)
+            const spec = await CaptureSpec.load(FACE_SERVICE_URL, '/verify');
+            const imageData = CaptureSpec.capture(video, canvas, spec);
             
             // Send to backend for verification
-            const response = await fetch("https://voter-verify-face-ofgu.onrender.com/api/verify", {
+            const response = await fetch(`${FACE_SERVICE_URL}/api/verify`, {
                 method: "POST",
                 mode: 'cors',
                 credentials: 'include',
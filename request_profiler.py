@@ -0,0 +1,232 @@
+"""On-demand profiling of a single face verification request.
+
+A request is profiled only when it carries ``X-Debug-Profile: 1`` together
+with the admin ``X-API-Key`` that guards the other ``/debug`` routes. When
+the header is absent, or the key is not valid, every hook below is a no-op.
+Saved profiles beyond the newest ``PROFILING_MAX_FILES`` are deleted.
+"""
+import contextvars
+import gc
+import json
+import os
+import sys
+import threading
+import time
+import tracemalloc
+import uuid
+from contextlib import contextmanager
+
+PROFILE_HEADER = 'X-Debug-Profile'
+SAMPLE_INTERVAL = float(os.environ.get('PROFILING_SAMPLE_INTERVAL', '0.005'))  # 5ms
+MAX_STACK_DEPTH = 40
+MAX_PROFILES = int(os.environ.get('PROFILING_MAX_FILES', 100))
+TOP_ALLOCATIONS = 25
+
+_current_profile = contextvars.ContextVar('request_profile', default=None)
+
+# tracemalloc is process-wide; overlapping profiles and the allocation tracker share it
+_tracemalloc_lock = threading.Lock()
+_tracemalloc_users = 0
+_tracemalloc_started = False
+
+
+def acquire_tracemalloc(frames):
+    """Make sure tracemalloc is tracing until the matching release_tracemalloc"""
+    global _tracemalloc_users, _tracemalloc_started
+    with _tracemalloc_lock:
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(frames)
+            _tracemalloc_started = True
+        _tracemalloc_users += 1
+
+
+def release_tracemalloc():
+    """Stop tracemalloc once its last user is done, unless something else started it"""
+    global _tracemalloc_users, _tracemalloc_started
+    with _tracemalloc_lock:
+        _tracemalloc_users = max(0, _tracemalloc_users - 1)
+        if _tracemalloc_users == 0 and _tracemalloc_started:
+            tracemalloc.stop()
+            _tracemalloc_started = False
+
+
+class RequestProfile:
+    """Sampled CPU profile, stage timings and allocation snapshot for one request"""
+
+    def __init__(self, route, interval=SAMPLE_INTERVAL):
+        self.id = uuid.uuid4().hex
+        self.route = route
+        self.interval = interval
+        self.stages = []
+        self.gc_events = []
+        self.samples = {}
+        self.sample_count = 0
+        self.allocations = []
+        self._gc_start = None
+        self._stop_event = threading.Event()
+        self._sampler = None
+        self._token = None
+        self._t0 = None
+        self.duration = None
+
+    def start(self):
+        self._t0 = time.perf_counter()
+        acquire_tracemalloc(10)
+        gc.callbacks.append(self._on_gc)
+        self._sampler = threading.Thread(target=self._sample_loop, name='request-profiler', daemon=True)
+        self._sampler.start()
+        self._token = _current_profile.set(self)
+        return self
+
+    def stop(self):
+        self.duration = time.perf_counter() - self._t0
+        self._stop_event.set()
+        self._sampler.join(timeout=1)
+        try:
+            gc.callbacks.remove(self._on_gc)
+        except ValueError:
+            pass
+        try:
+            snapshot = tracemalloc.take_snapshot()
+        finally:
+            release_tracemalloc()
+        snapshot = snapshot.filter_traces((
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, __file__),
+        ))
+        self.allocations = [
+            {
+                'location': f"{stat.traceback[0].filename}:{stat.traceback[0].lineno}",
+                'size_bytes': stat.size,
+                'count': stat.count
+            }
+            for stat in snapshot.statistics('lineno')[:TOP_ALLOCATIONS]
+        ]
+        if self._token is not None:
+            _current_profile.reset(self._token)
+            self._token = None
+
+    def record(self, name, start, end):
+        self.stages.append({
+            'stage': name,
+            'thread': threading.current_thread().name,
+            'start_ms': (start - self._t0) * 1000,
+            'duration_ms': (end - start) * 1000
+        })
+
+    @contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, start, time.perf_counter())
+
+    def wrap(self, func):
+        """Wrap func for executor.submit, timing the hand-off to the worker thread"""
+        submitted = time.perf_counter()
+
+        def run(*args, **kwargs):
+            self.record('executor_handoff', submitted, time.perf_counter())
+            return func(*args, **kwargs)
+        return run
+
+    def _on_gc(self, phase, info):
+        if phase == 'start':
+            self._gc_start = time.perf_counter()
+        elif self._gc_start is not None:
+            end = time.perf_counter()
+            self.gc_events.append({
+                'generation': info.get('generation'),
+                'collected': info.get('collected'),
+                'start_ms': (self._gc_start - self._t0) * 1000,
+                'duration_ms': (end - self._gc_start) * 1000
+            })
+            self._gc_start = None
+
+    def _sample_loop(self):
+        own_id = threading.get_ident()
+        names = {}
+        while not self._stop_event.wait(self.interval):
+            for thread in threading.enumerate():
+                names[thread.ident] = thread.name
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                stack = []
+                while frame is not None and len(stack) < MAX_STACK_DEPTH:
+                    code = frame.f_code
+                    stack.append(f"{os.path.basename(code.co_filename)}:{code.co_name}:{frame.f_lineno}")
+                    frame = frame.f_back
+                stack.append(names.get(thread_id, str(thread_id)))
+                key = ';'.join(reversed(stack))
+                self.samples[key] = self.samples.get(key, 0) + 1
+            self.sample_count += 1
+
+    def to_dict(self):
+        gc_total = sum(event['duration_ms'] for event in self.gc_events)
+        return {
+            'id': self.id,
+            'route': self.route,
+            'duration_ms': (self.duration or 0) * 1000,
+            'sample_interval_ms': self.interval * 1000,
+            'sample_count': self.sample_count,
+            'stages': self.stages,
+            'gc': {
+                'collections': len(self.gc_events),
+                'total_ms': gc_total,
+                'events': self.gc_events
+            },
+            # Collapsed stacks, one "frame;frame;... count" line each (flamegraph.pl / speedscope input)
+            'cpu_samples': [f"{stack} {count}" for stack, count in
+                            sorted(self.samples.items(), key=lambda item: -item[1])],
+            'top_allocations': self.allocations
+        }
+
+    def save(self, directory, keep=MAX_PROFILES):
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, f'{self.id}.json')
+        with open(path, 'w') as f:
+            json.dump(self.to_dict(), f)
+        prune(directory, keep)
+        return path
+
+
+def prune(directory, keep=MAX_PROFILES):
+    """Delete all but the newest keep profiles in directory"""
+    profiles = []
+    for entry in os.scandir(directory):
+        if not entry.name.endswith('.json'):
+            continue
+        try:
+            profiles.append((entry.stat().st_mtime, entry.path))
+        except FileNotFoundError:
+            pass
+    profiles.sort()
+    for _, path in profiles[:max(0, len(profiles) - keep)]:
+        try:
+            os.remove(path)
+        except FileNotFoundError:  # pruned by another worker
+            pass
+
+
+def begin(request, is_authorized):
+    """Start a profile for this request if it asked for one and is_authorized() holds, else return None"""
+    if request.headers.get(PROFILE_HEADER) not in ('1', 'true') or not is_authorized():
+        return None
+    return RequestProfile(request.path).start()
+
+
+def active_profile():
+    return _current_profile.get()
+
+
+@contextmanager
+def profile_stage(name):
+    """Time a block as a named stage of the active profile; no-op when not profiling"""
+    profile = _current_profile.get()
+    if profile is None:
+        yield
+        return
+    with profile.stage(name):
+        yield
@@ -0,0 +1,214 @@
+"""Facenet embedding as a persisted, fixed-signature TensorFlow graph.
+
+``DeepFace.build_model('Facenet')`` rebuilds the Keras model layer by
+layer and loads the weights, and the first ``predict`` then traces the
+graph. Workers are recycled every few requests, so every worker pays
+that again. ``python serving_graph.py export`` does it once and saves
+the embedding function as a SavedModel with one concrete signature,
+float32 [batch, 160, 160, 3] (RGB scaled to [0, 1]) -> [batch, 128].
+Workers load that graph directly, with no Keras construction or tracing.
+
+Artefacts live under ``<DEEPFACE_DIR>/serving/facenet-<key>``. The key
+covers the weights file hash and the DeepFace and TensorFlow versions,
+so new weights or a library upgrade never load a stale graph; the
+server falls back to DeepFace until the export is rerun.
+
+``python serving_graph.py benchmark`` measures time-to-first-inference
+for both paths, each in a fresh process.
+"""
+import argparse
+import hashlib
+import importlib.metadata
+import json
+import logging
+import os
+import shutil
+import subprocess
+import sys
+import time
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+DEEPFACE_DIR = os.environ.get('DEEPFACE_HOME', os.path.join(os.getcwd(), 'deepface_weights'))
+FACENET_INPUT_SHAPE = (160, 160, 3)
+WEIGHTS_FILE = 'facenet_weights.h5'
+EXPORT_FORMAT = 2  # part of the key; bumped when the export layout changes
+
+
+def weights_path(deepface_dir=DEEPFACE_DIR):
+    return os.path.join(deepface_dir, '.deepface', 'weights', WEIGHTS_FILE)
+
+
+def weights_hash(path):
+    """sha256 of the weights file, remembered next to it while its size and mtime are unchanged"""
+    stat = os.stat(path)
+    sidecar = path + '.sha256.json'
+    try:
+        with open(sidecar) as f:
+            cached = json.load(f)
+        if cached['size'] == stat.st_size and cached['mtime_ns'] == stat.st_mtime_ns:
+            return cached['sha256']
+    except (OSError, ValueError, KeyError):
+        pass
+
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    try:
+        with open(sidecar, 'w') as f:
+            json.dump({'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'sha256': digest.hexdigest()}, f)
+    except OSError:
+        pass
+    return digest.hexdigest()
+
+
+def _package_version(*names):
+    for name in names:
+        try:
+            return importlib.metadata.version(name)
+        except importlib.metadata.PackageNotFoundError:
+            continue
+    return 'unknown'
+
+
+def artefact_key(deepface_dir=DEEPFACE_DIR):
+    """Key of the graph matching the installed weights and libraries, or None without weights"""
+    path = weights_path(deepface_dir)
+    if not os.path.exists(path):
+        return None
+    # Package metadata, so checking the key does not import DeepFace or TensorFlow
+    deepface_version = _package_version('deepface')
+    tf_version = _package_version('tensorflow-cpu', 'tensorflow')
+    return f"{weights_hash(path)[:16]}-deepface{deepface_version}-tf{tf_version}-v{EXPORT_FORMAT}"
+
+
+def artefact_path(deepface_dir=DEEPFACE_DIR, key=None):
+    key = key or artefact_key(deepface_dir)
+    return os.path.join(deepface_dir, 'serving', f'facenet-{key}') if key else None
+
+
+def export(deepface_dir=DEEPFACE_DIR, force=False):
+    """Export the Facenet graph for the current weights and libraries; returns its path"""
+    path = artefact_path(deepface_dir)
+    if path is not None and os.path.exists(path) and not force:
+        logger.info(f"Serving graph already exported at {path}")
+        return path
+
+    import tensorflow as tf
+    from deepface import DeepFace
+
+    # Builds the model and, on a fresh install, downloads the weights the key is derived from
+    model = DeepFace.build_model('Facenet')
+    path = artefact_path(deepface_dir)
+    if path is None:
+        raise RuntimeError(f'Facenet weights not found at {weights_path(deepface_dir)}')
+
+    # Track only the variables: with the Keras model attached, the SavedModel also carries every
+    # layer's traced call functions and loading it takes longer than building the model
+    module = tf.Module()
+    module.weights = list(model.weights)
+
+    @tf.function(input_signature=[tf.TensorSpec([None, *FACENET_INPUT_SHAPE], tf.float32, name='images')])
+    def serve(images):
+        return {'embedding': model(images, training=False)}
+
+    module.serve = serve
+    tmp_path = f'{path}.tmp-{os.getpid()}'
+    shutil.rmtree(tmp_path, ignore_errors=True)
+    tf.saved_model.save(module, tmp_path, signatures={'serving_default': serve})
+    with open(os.path.join(tmp_path, 'export.json'), 'w') as f:
+        json.dump({'key': os.path.basename(path)[len('facenet-'):], 'exportedAt': time.time()}, f)
+    shutil.rmtree(path, ignore_errors=True)
+    os.replace(tmp_path, path)
+    logger.info(f"Exported serving graph to {path}")
+    return path
+
+
+def load(deepface_dir=DEEPFACE_DIR):
+    """Embedding function from the exported graph, or None when there is none for the current key.
+
+    The function maps a float32 (N, 160, 160, 3) batch to (N, 128) embeddings.
+    """
+    path = artefact_path(deepface_dir)
+    if path is None or not os.path.isdir(path):
+        return None
+    import tensorflow as tf
+    signature = tf.saved_model.load(path).signatures['serving_default']
+
+    def embed(batch):
+        return signature(images=tf.convert_to_tensor(batch, dtype=tf.float32))['embedding'].numpy()
+
+    return embed
+
+
+def time_to_first_inference(source, deepface_dir=DEEPFACE_DIR):
+    """Seconds to a first embedding in this process, via the exported graph or DeepFace"""
+    started = time.perf_counter()
+    importlib.import_module('tensorflow')  # the import is part of what a new worker pays
+    imported = time.perf_counter()
+    if source == 'graph':
+        embed = load(deepface_dir)
+        if embed is None:
+            raise RuntimeError('No exported serving graph for the current weights; run export first')
+    else:
+        from deepface import DeepFace
+        model = DeepFace.build_model('Facenet')
+
+        def embed(batch):
+            return model.predict(batch, verbose=0)
+    loaded = time.perf_counter()
+    embed(np.zeros((1, *FACENET_INPUT_SHAPE), dtype=np.float32))
+    done = time.perf_counter()
+    return {
+        'importSeconds': imported - started,
+        'loadSeconds': loaded - imported,
+        'firstInferenceSeconds': done - loaded,
+        'totalSeconds': done - started
+    }
+
+
+def _measure(source, deepface_dir):
+    output = subprocess.run(
+        [sys.executable, os.path.abspath(__file__), 'measure', source, '--deepface-dir', deepface_dir],
+        check=True, capture_output=True, text=True
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Export and benchmark the persisted Facenet serving graph')
+    parser.add_argument('command', choices=('export', 'benchmark', 'measure'))
+    parser.add_argument('source', nargs='?', choices=('graph', 'keras'), help='measure only')
+    parser.add_argument('--deepface-dir', default=DEEPFACE_DIR)
+    parser.add_argument('--force', action='store_true', help='Re-export even if the graph exists')
+    parser.add_argument('--runs', type=int, default=3, help='Fresh processes per path when benchmarking')
+    args = parser.parse_args(argv)
+    os.environ['DEEPFACE_HOME'] = args.deepface_dir
+
+    if args.command == 'export':
+        logging.basicConfig(level=logging.INFO)
+        print(export(args.deepface_dir, args.force))
+    elif args.command == 'measure':
+        print(json.dumps(time_to_first_inference(args.source, args.deepface_dir)))
+    else:
+        export(args.deepface_dir)
+        results = {source: [_measure(source, args.deepface_dir) for _ in range(args.runs)]
+                   for source in ('keras', 'graph')}
+        median = {source: {key: float(np.median([run[key] for run in runs])) for key in runs[0]}
+                  for source, runs in results.items()}
+        print(json.dumps({
+            'runs': args.runs,
+            'medianSeconds': median,
+            'timeToFirstInferenceReduction': 1 - median['graph']['totalSeconds'] / median['keras']['totalSeconds'],
+            'loadAndFirstInferenceReduction': 1 - (
+                (median['graph']['loadSeconds'] + median['graph']['firstInferenceSeconds']) /
+                (median['keras']['loadSeconds'] + median['keras']['firstInferenceSeconds'])
+            )
+        }, indent=2))
+
+
+if __name__ == '__main__':
+    main()
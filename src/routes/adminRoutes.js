@@ -264,7 +264,7 @@ router.post("/verify-face", authenticateAdmin, async (req, res) => {
     }
     
     // Verify the face
-    const verificationResult = await faceService.verifyFace(image1, image2);
+    const verificationResult = await faceService.verifyFace(image1, image2, userId);
     
     if (!verificationResult.success) {
       return res.status(500).json({
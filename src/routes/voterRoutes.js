@@ -279,7 +279,7 @@ router.post('/face/verify', authMiddleware, async (req, res) => {
         }
 
         // Verify face with the service
-        const verificationResult = await faceService.verifyFace(user.faceImage, faceImage);
+        const verificationResult = await faceService.verifyFace(user.faceImageUrl || user.faceImage, faceImage, user._id);
         
         if (verificationResult.success && verificationResult.isMatch) {
             // Reset verification attempts on success
@@ -1,6 +1,10 @@
 const axios = require('axios');
+const crypto = require('crypto');
 const cloudinary = require('cloudinary').v2;
 
+// Matches the face service's /verify capture spec (320px, JPEG quality 0.85)
+const REFERENCE_TRANSFORMATION = 'c_limit,w_320,h_320,q_85,f_jpg';
+
 class FaceVerificationService {
     constructor() {
         this.baseURL = 'https://voter-verify-face-ofgu.onrender.com';
@@ -55,7 +59,7 @@ class FaceVerificationService {
         return false;
     }
 
-    async registerFace(userId, faceImage) {
+    async registerFace(userId, faceImage, requestId = crypto.randomUUID()) {
         let lastError = null;
         
         // Wait for service to be ready
@@ -85,7 +89,8 @@ class FaceVerificationService {
                     withCredentials: true,
                     headers: {
                         'Content-Type': 'application/json',
-                        'Accept': 'application/json'
+                        'Accept': 'application/json',
+                        'X-Request-Id': requestId
                     }
                 });
 
@@ -96,11 +101,12 @@ class FaceVerificationService {
                 return {
                     success: true,
                     message: response.data.message,
-                    userId: response.data.userId
+                    userId: response.data.userId,
+                    requestId
                 };
 
             } catch (error) {
-                console.error(`Registration attempt ${attempt} failed:`, error.response?.data || error.message);
+                console.error(`Registration attempt ${attempt} failed [${requestId}]:`, error.response?.data || error.message);
                 lastError = error;
                 
                 if (attempt < this.maxRetries) {
@@ -112,7 +118,21 @@ class FaceVerificationService {
         throw new Error(lastError?.response?.data?.message || lastError?.message || 'Face registration failed after all retries');
     }
 
-    async verifyFace(image1, image2) {
+    // Base64 payload for /verify. Stored references on Cloudinary are fetched through a
+    // transformation that fits the face capture spec, so full-size originals never reach the service.
+    async imagePayload(image) {
+        if (/^https?:\/\//.test(image)) {
+            const url = image.includes('/image/upload/')
+                ? image.replace('/image/upload/', `/image/upload/${REFERENCE_TRANSFORMATION}/`)
+                : image;
+            const response = await axios.get(url, { responseType: 'arraybuffer', timeout: 10000 });
+            return Buffer.from(response.data).toString('base64');
+        }
+        return image.startsWith('data:image') ? image.split(',')[1] : image;
+    }
+
+    async verifyFace(image1, image2, voterId = null, requestId = crypto.randomUUID()) {
+        // One ID for every attempt, so retries show up as one trace in the face service
         let lastError = null;
         
         for (let attempt = 1; attempt <= this.maxRetries; attempt++) {
@@ -129,26 +149,23 @@ class FaceVerificationService {
                 }
 
                 // Process images
-                let processedImage1 = image1;
-                let processedImage2 = image2;
-
-                if (!processedImage1.startsWith('data:image')) {
-                    processedImage1 = `data:image/jpeg;base64,${processedImage1}`;
-                }
-
-                if (!processedImage2.startsWith('data:image')) {
-                    processedImage2 = `data:image/jpeg;base64,${processedImage2}`;
-                }
+                const [payload1, payload2] = await Promise.all([
+                    this.imagePayload(image1),
+                    this.imagePayload(image2)
+                ]);
 
                 const response = await axios.post(`${this.baseURL}/verify`, {
-                    image1: processedImage1.split(',')[1],
-                    image2: processedImage2.split(',')[1]
+                    image1: payload1,
+                    image2: payload2,
+                    // Recorded in the face service's audit log
+                    voterId: voterId ? String(voterId) : undefined
                 }, {
                     timeout: 30000,
                     withCredentials: true,
                     headers: {
                         'Content-Type': 'application/json',
-                        'Accept': 'application/json'
+                        'Accept': 'application/json',
+                        'X-Request-Id': requestId
                     }
                 });
 
@@ -160,11 +177,12 @@ class FaceVerificationService {
                     success: true,
                     matchPercentage: response.data.matchPercentage || 0,
                     isMatch: response.data.isMatch || false,
-                    error: null
+                    error: null,
+                    requestId
                 };
 
             } catch (error) {
-                console.error(`Attempt ${attempt} failed:`, error.response?.data || error.message);
+                console.error(`Attempt ${attempt} failed [${requestId}]:`, error.response?.data || error.message);
                 lastError = error;
                 
                 if (attempt < this.maxRetries) {
@@ -177,7 +195,8 @@ class FaceVerificationService {
             success: false,
             matchPercentage: 0,
             isMatch: false,
-            error: lastError?.response?.data?.message || lastError?.message || 'Face verification failed after all retries'
+            error: lastError?.response?.data?.message || lastError?.message || 'Face verification failed after all retries',
+            requestId
         };
     }
 }
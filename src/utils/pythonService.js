@@ -1,4 +1,5 @@
 const axios = require('axios');
+const crypto = require('crypto');
 const config = require('../config');
 
 const pythonService = axios.create({
@@ -10,27 +11,31 @@ const pythonService = axios.create({
 });
 
 module.exports = {
-    verifyFace: async (imageData) => {
+    verifyFace: async (imageData, requestId = crypto.randomUUID()) => {
         try {
             const response = await pythonService.post('/verify-face', {
                 image: imageData
+            }, {
+                headers: { 'X-Request-Id': requestId }
             });
             return response.data;
         } catch (error) {
-            console.error('Error calling Python service:', error.message);
+            console.error(`Error calling Python service [${requestId}]:`, error.message);
             throw error;
         }
     },
 
-    compareFaces: async (image1, image2) => {
+    compareFaces: async (image1, image2, requestId = crypto.randomUUID()) => {
         try {
             const response = await pythonService.post('/compare-faces', {
                 image1,
                 image2
+            }, {
+                headers: { 'X-Request-Id': requestId }
             });
             return response.data;
         } catch (error) {
-            console.error('Error calling Python service:', error.message);
+            console.error(`Error calling Python service [${requestId}]:`, error.message);
             throw error;
         }
     }
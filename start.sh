@@ -19,6 +19,9 @@ if [ -f "facenet_keras.h5" ]; then
     cp facenet_keras.h5 deepface_weights/.deepface/weights/
 fi
 
+# Export the Facenet serving graph (a no-op when one exists for these weights) so workers skip model construction
+python serving_graph.py export || echo "Serving graph export failed; workers will build Facenet with DeepFace"
+
 # Start the server using gunicorn
 echo "Starting server on port $PORT..."
 exec gunicorn \
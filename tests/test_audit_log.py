@@ -0,0 +1,137 @@
+import os
+import threading
+import time
+
+import pytest
+
+import audit_log
+from audit_log import AuditLog, encode_record, iter_records, scan, segment_paths
+
+
+def records(n):
+    return [encode_record(1700000000.0 + i, '/verify-voting', f'V{i}', 0.25, 0.4, 37.5, i % 2 == 0,
+                          model='Facenet', request_id=f'req{i}') for i in range(n)]
+
+
+def record(log, i):
+    return log.record('/verify-voting', f'V{i}', 0.25, 0.4, 37.5, i % 2 == 0, model='Facenet', request_id=f'req{i}')
+
+
+def wait_for(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, 'timed out'
+        time.sleep(0.005)
+
+
+def test_iter_records_round_trip():
+    decoded = [record for _, record in iter_records(b''.join(records(3)))]
+    assert [record['voterId'] for record in decoded] == ['V0', 'V1', 'V2']
+    assert decoded[1]['verified'] is False
+    assert decoded[0]['distance'] == 0.25 and decoded[0]['requestId'] == 'req0'
+
+
+def test_iter_records_stops_at_truncated_tail():
+    encoded = records(3)
+    data = b''.join(encoded)
+    for cut in range(1, len(encoded[-1])):
+        decoded = list(iter_records(data[:-cut]))
+        assert [record['voterId'] for _, record in decoded] == ['V0', 'V1']
+        assert decoded[-1][0] == len(encoded[0]) + len(encoded[1])
+
+
+def test_iter_records_stops_at_corrupt_record():
+    encoded = records(3)
+    corrupt = bytearray(encoded[1])
+    corrupt[-1] ^= 0xFF
+    decoded = list(iter_records(encoded[0] + bytes(corrupt) + encoded[2]))
+    assert [record['voterId'] for _, record in decoded] == ['V0']
+
+
+def test_record_close_then_scan(tmp_path):
+    log = AuditLog(str(tmp_path))
+    for i in range(3):
+        assert record(log, i)
+    log.record('/verify-face', 'V9', None, None, None, False, image_url='https://example.com/v9.jpg')
+    log.close()
+    assert log.stats() == {'written': 4, 'dropped': 0, 'queued': 0}
+    assert not record(log, 10)  # closed
+
+    decoded = list(scan(str(tmp_path)))
+    assert [r['voterId'] for r in decoded] == ['V0', 'V1', 'V2', 'V9']
+    assert decoded[0]['model'] == 'Facenet' and decoded[1]['verified'] is False
+    assert decoded[3]['distance'] != decoded[3]['distance']  # NaN for a missing field
+    assert [r['voterId'] for r in scan(str(tmp_path), route='/verify-face')] == ['V9']
+    assert [r['voterId'] for r in scan(str(tmp_path), verified=True)] == ['V0', 'V2']
+
+
+def test_close_without_records_writes_nothing(tmp_path):
+    AuditLog(str(tmp_path)).close()
+    assert segment_paths(str(tmp_path)) == []
+
+
+def test_full_queue_drops_instead_of_blocking(tmp_path, monkeypatch):
+    log = AuditLog(str(tmp_path), queue_size=1)
+    release = threading.Event()
+    write_batch = log._write_batch
+
+    def stalled(batch):
+        release.wait()
+        write_batch(batch)
+    monkeypatch.setattr(log, '_write_batch', stalled)
+
+    accepted = [record(log, i) for i in range(5)]
+    # At most two entries reach the stalled writer's batch and one more waits in the queue
+    assert accepted.count(False) >= 2 and log.dropped == accepted.count(False)
+    release.set()
+    log.close()
+    assert log.written == accepted.count(True)
+    assert len(list(scan(str(tmp_path)))) == log.written
+
+
+def test_fsync_runs_on_the_interval_without_close(tmp_path, monkeypatch):
+    synced = []
+    fsync = os.fsync
+    monkeypatch.setattr(audit_log.os, 'fsync', lambda fd: (synced.append(fd), fsync(fd)))
+    log = AuditLog(str(tmp_path), fsync_interval=0.05)
+    record(log, 0)
+    wait_for(lambda: log.written == 1)
+    segment = log._file.fileno()
+    wait_for(lambda: segment in synced and not log._unsynced)
+    log.close()
+
+
+def test_segments_rotate_and_scan_reads_across_them(tmp_path):
+    log = AuditLog(str(tmp_path), segment_bytes=1)  # rotate before every batch
+    for i in range(3):
+        record(log, i)
+        wait_for(lambda: log.written == i + 1)
+        time.sleep(0.002)  # segments are named by their first timestamp in ms
+    log.close()
+
+    paths = segment_paths(str(tmp_path))
+    assert len(paths) == 3
+    assert all(os.path.getsize(path) > 0 for path in paths)
+    assert [r['voterId'] for r in scan(str(tmp_path))] == ['V0', 'V1', 'V2']
+    assert [r['voterId'] for r in scan(str(tmp_path), voter_id='V1')] == ['V1']
+
+
+@pytest.mark.skipif(not hasattr(os, 'fork'), reason='needs fork')
+def test_forked_child_writes_its_own_segment(tmp_path):
+    log = AuditLog(str(tmp_path))
+    record(log, 0)  # the parent's writer thread is running when it forks
+    wait_for(lambda: log.written == 1)
+    pid = os.fork()
+    if pid == 0:
+        ok = log.written == 0  # a fresh writer
+        record(log, 1)
+        log.close()
+        os._exit(0 if ok and log.written == 1 else 1)
+    _, status = os.waitpid(pid, 0)
+    assert os.WEXITSTATUS(status) == 0
+    record(log, 2)
+    log.close()
+
+    pids = sorted(int(os.path.basename(path)[:-len('.log')].split('-')[2]) for path in segment_paths(str(tmp_path)))
+    assert pids == sorted([os.getpid(), pid])
+    assert sorted(r['voterId'] for r in scan(str(tmp_path))) == ['V0', 'V1', 'V2']
@@ -0,0 +1,153 @@
+import glob
+import os
+
+import numpy as np
+import pytest
+
+from embedding_store import EMBEDDING_DIM, EmbeddingStore
+
+
+def embedding(seed):
+    return np.random.default_rng(seed).random(EMBEDDING_DIM, dtype=np.float32)
+
+
+def open_store(directory, **kwargs):
+    return EmbeddingStore(str(directory), group_commit_interval=0, lock_timeout=0, **kwargs)
+
+
+def test_snapshot_then_replay(tmp_path):
+    store = open_store(tmp_path)
+    store.put_many((f'u{i}', embedding(i)) for i in range(5))
+    store.snapshot()
+    store.put('u5', embedding(5))
+    store.put('u0', embedding(50))
+    store.close()
+
+    assert len(glob.glob(str(tmp_path / 'snapshot-*.npz'))) == 1
+    store = open_store(tmp_path)
+    assert len(store) == 6
+    assert store._since_snapshot == 2  # only the records after the snapshot are replayed
+    np.testing.assert_array_equal(store.get('u0'), embedding(50))
+    np.testing.assert_array_equal(store.get('u5'), embedding(5))
+    assert store.version_of('u0') == 7
+    store.close()
+
+
+def test_torn_tail_is_truncated(tmp_path):
+    store = open_store(tmp_path)
+    store.put('a', embedding(1))
+    store.put('b', embedding(2))
+    store.close()
+
+    (segment,) = glob.glob(str(tmp_path / 'log-*.wal'))
+    intact = os.path.getsize(segment)
+    with open(segment, 'r+b') as f:
+        f.truncate(intact - 10)  # the second record loses its last bytes
+
+    store = open_store(tmp_path)
+    assert 'a' in store and 'b' not in store
+    assert os.path.getsize(segment) == intact - 10  # readers leave the tail alone
+    store.put('c', embedding(3))  # the writer cuts it before appending
+    store.close()
+
+    store = open_store(tmp_path)
+    assert sorted(store._index) == ['a', 'c']
+    np.testing.assert_array_equal(store.get('c'), embedding(3))
+    store.close()
+
+
+def test_delete_survives_restart(tmp_path):
+    store = open_store(tmp_path)
+    store.put('a', embedding(1))
+    store.put('b', embedding(2))
+    assert store.delete('a')
+    assert not store.delete('a')
+    store.close()
+
+    store = open_store(tmp_path)
+    assert 'a' not in store and store.get('a') is None
+    assert len(store) == 1
+    store.snapshot()
+    store.close()
+
+    store = open_store(tmp_path)
+    assert sorted(store._index) == ['b']
+    store.close()
+
+
+def test_one_writer_per_directory(tmp_path):
+    store = open_store(tmp_path)
+    other = open_store(tmp_path)  # opening to read is always allowed
+    store.put('a', embedding(1))
+    with pytest.raises(RuntimeError, match='in use by another process'):
+        other.put('b', embedding(2))
+    store.close()
+    other.close()
+
+
+def test_writer_reloads_what_another_writer_appended(tmp_path):
+    store = open_store(tmp_path)
+    other = open_store(tmp_path)
+    other.put('a', embedding(1))
+    other.close()
+
+    store.put('b', embedding(2))
+    assert sorted(store._index) == ['a', 'b']
+    assert store.version_of('b') == 2
+    store.close()
+
+    store = open_store(tmp_path)
+    assert sorted(store._index) == ['a', 'b']
+    store.close()
+
+
+@pytest.mark.skipif(not hasattr(os, 'fork'), reason='needs fork')
+def test_forked_child_reloads_and_writes(tmp_path):
+    store = open_store(tmp_path)
+    for i in range(2):
+        pid = os.fork()
+        if pid == 0:
+            ok = len(store) == i
+            store.put(f'u{i}', embedding(i))
+            os._exit(0 if ok else 1)
+        _, status = os.waitpid(pid, 0)
+        assert os.WEXITSTATUS(status) == 0
+    store.close()
+
+    store = open_store(tmp_path)
+    assert sorted(store._index) == ['u0', 'u1']
+    store.close()
+
+
+@pytest.mark.skipif(not hasattr(os, 'fork'), reason='needs fork')
+def test_forked_writers_exclude_each_other(tmp_path):
+    store = open_store(tmp_path)
+    store.put('parent', embedding(0))  # the parent's lock is not inherited by its children
+    store.close()
+
+    store = open_store(tmp_path)
+    locked_r, locked_w = os.pipe()
+    release_r, release_w = os.pipe()
+    first = os.fork()
+    if first == 0:
+        store.put('first', embedding(1))
+        os.write(locked_w, b'1')
+        os.read(release_r, 1)  # keep the lock until the second child has tried
+        os._exit(0)
+    os.read(locked_r, 1)
+    second = os.fork()
+    if second == 0:
+        try:
+            store.put('second', embedding(2))
+        except RuntimeError:
+            os._exit(0)
+        os._exit(1)
+    _, status = os.waitpid(second, 0)
+    os.write(release_w, b'1')
+    os.waitpid(first, 0)
+    assert os.WEXITSTATUS(status) == 0
+    store.close()
+
+    store = open_store(tmp_path)
+    assert sorted(store._index) == ['first', 'parent']
+    store.close()
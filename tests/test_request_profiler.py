@@ -0,0 +1,13 @@
+import os
+
+from request_profiler import RequestProfile
+
+
+def test_save_keeps_only_the_newest_profiles(tmp_path):
+    saved = []
+    for i in range(5):
+        profile = RequestProfile('/verify-voting')
+        path = profile.save(str(tmp_path), keep=3)
+        os.utime(path, (1700000000 + i, 1700000000 + i))
+        saved.append(os.path.basename(path))
+    assert sorted(os.listdir(tmp_path)) == sorted(saved[2:])
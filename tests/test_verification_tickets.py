@@ -0,0 +1,69 @@
+import os
+
+from verification_tickets import TicketStore
+
+
+def open_store(directory, **kwargs):
+    return TicketStore(str(directory), secret=b'k' * 32, **kwargs)
+
+
+def test_ticket_is_single_use(tmp_path):
+    store = open_store(tmp_path)
+    ticket, expires_at = store.issue('V1', 'booth-1', {'matchPercentage': 90})
+    entry = store.redeem(ticket, 'V1', 'booth-1')
+    assert entry['decision'] == {'matchPercentage': 90} and entry['expiresAt'] == expires_at
+    assert store.redeem(ticket, 'V1', 'booth-1') is None
+
+
+def test_ticket_carries_no_claims(tmp_path):
+    ticket, _ = open_store(tmp_path).issue('V1', 'booth-1', {})
+    ticket_id, _ = ticket.split('.')
+    assert 'V1' not in ticket and 'booth' not in ticket and len(ticket_id) == 32
+
+
+def test_wrong_voter_device_or_signature_is_refused(tmp_path):
+    store = open_store(tmp_path)
+    ticket, _ = store.issue('V1', 'booth-1', {})
+    ticket_id, signature = ticket.split('.')
+    assert store.redeem(ticket, 'V2', 'booth-1') is None
+    assert store.redeem(f'{ticket_id}.{signature[:-1]}é', 'V1', 'booth-1') is None
+    assert store.redeem(12345, 'V1', 'booth-1') is None
+    assert store.redeem(ticket, 'V1', 'booth-2') is None  # presenting it on another device spends it
+
+
+def test_tickets_outlive_the_store_and_expire(tmp_path):
+    ticket, _ = open_store(tmp_path).issue('V1', 'booth-1', {})
+    assert open_store(tmp_path).redeem(ticket, 'V1', 'booth-1') is not None
+
+    store = open_store(tmp_path, ttl=0)
+    ticket, _ = store.issue('V1', 'booth-1', {})
+    assert store.redeem(ticket, 'V1', 'booth-1') is None
+
+
+def test_revoke_voter(tmp_path):
+    store = open_store(tmp_path)
+    tickets = [store.issue('V1', 'booth-1', {})[0] for _ in range(2)]
+    other, _ = store.issue('V2', 'booth-1', {})
+    assert store.revoke_voter('V1') == 2
+    assert all(store.redeem(ticket, 'V1', 'booth-1') is None for ticket in tickets)
+    assert store.redeem(other, 'V2', 'booth-1') is not None
+
+
+def test_secret_is_shared_through_the_directory(tmp_path, monkeypatch):
+    monkeypatch.delenv('TICKET_SECRET', raising=False)
+    first = TicketStore(str(tmp_path))
+    ticket, _ = first.issue('V1', 'booth-1', {})
+    assert TicketStore(str(tmp_path)).redeem(ticket, 'V1', 'booth-1') is not None
+    assert oct(os.stat(tmp_path / '.secret').st_mode & 0o777) == '0o600'
+
+
+def test_issue_sweeps_on_interval_or_cap(tmp_path, monkeypatch):
+    store = open_store(tmp_path, max_entries=3)
+    sweeps = []
+    purge = store._purge
+    monkeypatch.setattr(store, '_purge', lambda now: sweeps.append(now) or purge(now))
+    for _ in range(3):
+        store.issue('V1', 'booth-1', {})
+    assert len(sweeps) == 1  # the first issue; the rest are within the interval and the cap
+    store.issue('V1', 'booth-1', {})
+    assert len(sweeps) == 2 and len(store) == 3
@@ -0,0 +1,144 @@
+"""Request tracing for the face verification service.
+
+Each request joins the trace named by its ``X-Request-Id`` header (or the
+trace ID of a W3C ``traceparent`` header), or starts a new one. Spans for
+queue wait, decode, quality check, inference, backend fetch and upload are
+collected per request, kept in an in-memory ring buffer and, when
+``TRACE_EXPORT_FILE`` is set, appended to that file as JSON lines. The
+trace ID is echoed in the response and forwarded on outgoing calls so a
+slow check can be followed from the Node backend into this service.
+"""
+import contextvars
+import json
+import logging
+import os
+import re
+import threading
+import time
+import uuid
+from collections import deque
+from contextlib import contextmanager
+
+from request_profiler import profile_stage
+
+logger = logging.getLogger(__name__)
+
+TRACE_HEADER = 'X-Request-Id'
+TRACE_BUFFER_SIZE = int(os.environ.get('TRACE_BUFFER_SIZE', 1000))
+TRACE_EXPORT_FILE = os.environ.get('TRACE_EXPORT_FILE')
+_TRACEPARENT = re.compile(r'^[0-9a-f]{2}-([0-9a-f]{32})-[0-9a-f]{16}-[0-9a-f]{2}$')
+_VALID_ID = re.compile(r'^[A-Za-z0-9._:-]{1,128}$')
+
+_current_trace = contextvars.ContextVar('request_trace', default=None)
+
+
+class Trace:
+    def __init__(self, trace_id, name):
+        self.trace_id = trace_id
+        self.name = name
+        self.start = time.time()
+        self._t0 = time.perf_counter()
+        self.spans = []
+        self.attributes = {}
+
+    def add_span(self, name, start, end, attributes=None):
+        span = {
+            'name': name,
+            'startMs': (start - self._t0) * 1000,
+            'durationMs': (end - start) * 1000,
+            'thread': threading.current_thread().name
+        }
+        if attributes:
+            span['attributes'] = attributes
+        self.spans.append(span)
+
+    def to_dict(self):
+        return {
+            'traceId': self.trace_id,
+            'name': self.name,
+            'timestamp': self.start,
+            'durationMs': (time.perf_counter() - self._t0) * 1000,
+            'attributes': self.attributes,
+            'spans': self.spans
+        }
+
+
+class TraceExporter:
+    """Keeps the most recent traces in memory and optionally appends them to a JSONL file"""
+
+    def __init__(self, size=TRACE_BUFFER_SIZE, path=TRACE_EXPORT_FILE):
+        self._buffer = deque(maxlen=size)
+        self._lock = threading.Lock()
+        self._path = path
+
+    def export(self, trace):
+        record = trace.to_dict()
+        with self._lock:
+            self._buffer.append(record)
+            if self._path:
+                try:
+                    with open(self._path, 'a') as f:
+                        f.write(json.dumps(record) + '\n')
+                except OSError as e:
+                    logger.error(f"Trace export failed: {str(e)}")
+
+    def recent(self, trace_id=None, limit=50):
+        with self._lock:
+            traces = list(self._buffer)
+        if trace_id:
+            traces = [trace for trace in traces if trace['traceId'] == trace_id]
+        return traces[-limit:][::-1]
+
+
+exporter = TraceExporter()
+
+
+def incoming_trace_id(headers):
+    request_id = headers.get(TRACE_HEADER, '')
+    if _VALID_ID.match(request_id):
+        return request_id
+    match = _TRACEPARENT.match(headers.get('traceparent', ''))
+    if match:
+        return match.group(1)
+    return uuid.uuid4().hex
+
+
+def start_trace(headers, name):
+    """Start the trace for the current request; returns a token for finish_trace"""
+    trace = Trace(incoming_trace_id(headers), name)
+    return trace, _current_trace.set(trace)
+
+
+def finish_trace(trace, token, **attributes):
+    trace.attributes.update(attributes)
+    _current_trace.reset(token)
+    exporter.export(trace)
+
+
+def current_trace_id():
+    trace = _current_trace.get()
+    return trace.trace_id if trace else None
+
+
+def outgoing_headers(headers=None):
+    """Headers for an outgoing call, with the current trace ID added"""
+    headers = dict(headers or {})
+    trace_id = current_trace_id()
+    if trace_id:
+        headers[TRACE_HEADER] = trace_id
+    return headers
+
+
+@contextmanager
+def span(name, **attributes):
+    """Record a span in the current trace (and a stage in the active profile, if any)"""
+    with profile_stage(name):
+        trace = _current_trace.get()
+        if trace is None:
+            yield
+            return
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            trace.add_span(name, start, time.perf_counter(), attributes)
@@ -0,0 +1,173 @@
+"""Short-lived, single-use verification tickets for repeat checks within one booth visit.
+
+After a successful match the service issues a ticket bound to the voter
+and the capturing device. A later check by the same voter from the same
+device within ``TICKET_TTL_SECONDS`` presents the ticket instead of a
+new capture and is answered from the stored decision, with no backend
+fetch, decode or model call.
+
+A ticket is ``<ticket id>.<signature>``, a random ID and its HMAC-SHA256,
+and carries no claims. The voter, a keyed hash of the device ID and the
+decision are kept server-side, so a copied ticket tells its holder
+nothing about the device it is bound to. Redeeming a ticket consumes it;
+the response carries a fresh ticket with the same expiry for the next
+check, so a ticket that has already been used is refused.
+
+Entries are files under ``TICKET_DIR``, shared by every worker, so they
+survive worker recycling (``max_requests``) and restarts until they
+expire. The signing key comes from ``TICKET_SECRET`` or, when unset, a
+key file created in that directory on first use. Expired files are
+swept every ``PURGE_INTERVAL`` seconds, or sooner once this process has
+issued enough to pass ``TICKET_MAX_ENTRIES``; redemption checks expiry
+itself, so a swept-late ticket is still refused.
+
+Only the face service issues and redeems tickets so far: the Node
+backend and the web pages do not yet send ``X-Device-Id`` or call
+``/verify-ticket``.
+"""
+import hashlib
+import hmac
+import json
+import os
+import secrets
+import threading
+import time
+
+TICKET_DIR = os.environ.get('TICKET_DIR', os.path.join(os.getcwd(), 'tickets'))
+TICKET_TTL = int(os.environ.get('TICKET_TTL_SECONDS', 300))
+TICKET_HEADER = 'X-Verification-Ticket'
+DEVICE_HEADER = 'X-Device-Id'
+MAX_TICKETS = int(os.environ.get('TICKET_MAX_ENTRIES', 10000))
+SECRET_FILE = '.secret'
+PURGE_INTERVAL = 60  # seconds between sweeps of expired tickets
+
+
+def _load_secret(directory):
+    secret = os.environ.get('TICKET_SECRET', '')
+    if secret:
+        return secret.encode('utf-8')
+    path = os.path.join(directory, SECRET_FILE)
+    try:
+        fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+    except FileExistsError:
+        # Another worker created it; wait out its write
+        for _ in range(50):
+            with open(path, 'rb') as f:
+                secret = f.read()
+            if secret:
+                return secret
+            time.sleep(0.01)
+        raise RuntimeError(f'Ticket key file {path} is empty')
+    secret = secrets.token_bytes(32)
+    with os.fdopen(fd, 'wb') as f:
+        f.write(secret)
+    return secret
+
+
+class TicketStore:
+    def __init__(self, directory=TICKET_DIR, ttl=TICKET_TTL, max_entries=MAX_TICKETS, secret=None):
+        self.directory = directory
+        self.ttl = ttl
+        self.max_entries = max_entries
+        os.makedirs(directory, exist_ok=True)
+        self._secret = secret or _load_secret(directory)
+        self._purge_lock = threading.Lock()
+        self._next_purge = 0.0
+        self._live = 0  # entries at the last sweep plus those issued since, by this process
+
+    def _maybe_purge(self, now):
+        """Sweep on the interval or when over the cap, rather than on every issue"""
+        with self._purge_lock:
+            self._live += 1
+            if now < self._next_purge and self._live <= self.max_entries:
+                return
+            self._next_purge = now + min(PURGE_INTERVAL, self.ttl)
+            self._live = self._purge(now)
+
+    def _digest(self, purpose, value):
+        return hmac.new(self._secret, f'{purpose}:{value}'.encode('utf-8'), hashlib.sha256).hexdigest()
+
+    def _path(self, voter_id, ticket_id):
+        # Named by voter, so revocation and redemption never read another voter's entries
+        return os.path.join(self.directory, f"{self._digest('voter', voter_id)[:32]}-{ticket_id}.json")
+
+    def _purge(self, now):
+        """Remove expired entries, then the oldest ones beyond max_entries"""
+        entries = []
+        for entry in os.scandir(self.directory):
+            if not entry.name.endswith('.json'):
+                continue
+            try:
+                issued = entry.stat().st_mtime
+                if issued + self.ttl <= now:
+                    os.remove(entry.path)
+                else:
+                    entries.append((issued, entry.path))
+            except FileNotFoundError:
+                pass
+        entries.sort()
+        for _, path in entries[:max(0, len(entries) - self.max_entries)]:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+        return len(entries)
+
+    def issue(self, voter_id, device_id, decision, expires_at=None):
+        """Ticket for a successful match; decision is the response data to replay on the next check"""
+        now = time.time()
+        ticket_id = secrets.token_hex(16)
+        expires_at = int(now + self.ttl) if expires_at is None else expires_at
+        path = self._path(str(voter_id), ticket_id)
+        tmp_path = f'{path}.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump({
+                'voterId': str(voter_id),
+                'device': self._digest('device', device_id),
+                'issuedAt': now,
+                'expiresAt': expires_at,
+                'decision': decision
+            }, f)
+        os.replace(tmp_path, path)
+        self._maybe_purge(now)
+        return f"{ticket_id}.{self._digest('ticket', ticket_id)}", expires_at
+
+    def redeem(self, ticket, voter_id, device_id):
+        """Consume the ticket and return its entry when it is genuine, unused, unexpired and bound to
+        this voter and device, else None"""
+        try:
+            ticket_id, signature = ticket.split('.')
+            if not hmac.compare_digest(signature.encode('utf-8'), self._digest('ticket', ticket_id).encode('ascii')):
+                return None
+        except (AttributeError, TypeError, ValueError):
+            return None
+
+        path = self._path(str(voter_id), ticket_id)
+        try:
+            with open(path) as f:
+                entry = json.load(f)
+            # Only one concurrent redemption removes the file
+            os.remove(path)
+        except (OSError, ValueError):
+            return None
+
+        if entry['expiresAt'] <= time.time() or entry['voterId'] != str(voter_id):
+            return None
+        if not hmac.compare_digest(entry['device'], self._digest('device', device_id)):
+            return None
+        return entry
+
+    def revoke_voter(self, voter_id):
+        prefix = self._digest('voter', str(voter_id))[:32] + '-'
+        revoked = 0
+        for entry in os.scandir(self.directory):
+            if entry.name.startswith(prefix) and entry.name.endswith('.json'):
+                try:
+                    os.remove(entry.path)
+                    revoked += 1
+                except FileNotFoundError:
+                    pass
+        return revoked
+
+    def __len__(self):
+        return self._purge(time.time())